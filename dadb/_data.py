@@ -40,6 +40,10 @@ CACHESIZE = MAXBLOCKSIZE  # keep a cache of a single blocksize
 # max number of blocks to keep in memory when inserting a data object
 MAXCACHEDBLOCKS = int(536870912/MAXBLOCKSIZE)  # 512MB
 
+# max number of ids in a single query when fetching multiple data objects
+# (older sqlite versions allow at most 999 parameters in a single query)
+GET_MANY_BATCHSIZE = 500
+
 
 class DataInserter():
     ''' Class responsible for inserting Data objects into a DADB database
@@ -346,6 +350,12 @@ class DataManager():
             'FROM {:s}data WHERE {:s}id == ?'
         s.meta_query = q.format(*(prefix,)*7)
 
+        # the same query for multiple data objects (placeholders for the ids
+        # are filled in when the number of ids is known)
+        q = 'SELECT {:s}id, {:s}md5, {:s}sha1, {:s}sha256, {:s}size, {:s}stored ' +\
+            'FROM {:s}data WHERE {:s}id IN ({{:s}})'
+        s.meta_many_query = q.format(*(prefix,)*8)
+
         # query for selecting blocks for a specific range
         q = 'SELECT {:}offset, {:}blkid, {:}size, {:}data ' +\
             'FROM {:}blockmap JOIN {:}block ON {:}blkid = {:}block.{:}id ' +\
@@ -418,6 +428,31 @@ class DataManager():
         return d
 
 
+    def get_data_many(s, dbcon, ids):
+        ''' returns a dictionary with a Data object for each of the given ids
+
+        The metadata of the Data objects is fetched with a single query per
+        batch of GET_MANY_BATCHSIZE ids, instead of a query per Data object.
+        '''
+
+        ids = list(set([id_ for id_ in ids if id_ is not None]))
+
+        # fetch the metadata in batches, to stay well below the maximum
+        # number of parameters in a single query
+        cursor = dbcon.cursor()
+        metadata = {}
+        for i in range(0, len(ids), GET_MANY_BATCHSIZE):
+            batch = ids[i:i+GET_MANY_BATCHSIZE]
+            q = s.meta_many_query.format(','.join('?'*len(batch)))
+            for r in cursor.execute(q, batch):
+                metadata[r[0]] = r[1:]
+
+        if len(metadata) != len(ids):
+            raise _NoSuchDataObjectError('Data object with given id not available')
+
+        return {id_:Data(s, dbcon, id_, meta) for id_, meta in metadata.items()}
+
+
     def data_by_sha256(s, sha256, cursor):
         ''' returns rowids of data objects with the given sha256 '''
 
@@ -516,8 +551,12 @@ class Data(_IOBase):
     ''' class to access data as file-like-object '''
 
 
-    def __init__(s, data_manager, dbcon, dataid):
-        ''' initialize Data object '''
+    def __init__(s, data_manager, dbcon, dataid, meta=None):
+        ''' initialize Data object
+
+        The metadata (md5, sha1, sha256, size, stored) is fetched from the
+        database, unless it is given by the caller.
+        '''
 
         # we use this class only for reading data, use dedicated cursor
         # for each active Data object
@@ -527,8 +566,10 @@ class Data(_IOBase):
         s._data_manager = data_manager
 
         # fetch hashes and if blocks are stored
-        r = s._cursor.execute(s._data_manager.meta_query, (s._dataid,))
-        s.md5, s.sha1, s.sha256, s.length, s.stored = next(r)
+        if meta is None:
+            r = s._cursor.execute(s._data_manager.meta_query, (s._dataid,))
+            meta = next(r)
+        s.md5, s.sha1, s.sha256, s.length, s.stored = meta
         s.stored=bool(s.stored)
 
         # set position to 0
@@ -723,8 +764,9 @@ class Data(_IOBase):
             breadpos = readpos-boffset
             breadend = breadpos + blockread
 
-            # copy bytes from blockdata into buffer b
-            b[outpos:outpos+blockread] = bdata[breadpos:breadend]
+            # copy bytes from blockdata into buffer b (via memoryview, to
+            # prevent creating an intermediate copy of the slice)
+            b[outpos:outpos+blockread] = memoryview(bdata)[breadpos:breadend]
 
             # update offsets and amount of read bytes
             readpos += blockread
@@ -758,6 +800,15 @@ class Data(_IOBase):
         if toread > (s.length - s._pos):
             raise IOError('not enough bytes available to fill provided array')
 
+        # Large reads are typically sequential (i.e. when the data is scanned
+        # in a blockwise manner), so these bypass the cache. The blocks are
+        # copied directly into the given buffer, without copying them into
+        # the cache first and without keeping the last part in cache.
+        if toread >= CACHESIZE:
+            s._readcache(memoryview(b), readpos, debug)
+            s._pos = readpos + toread
+            return toread
+
         # make sure initial readpos is inside cache
         if s._cache_start > readpos or readpos >= s._cache_end:
             s._init_cache(readpos, debug)
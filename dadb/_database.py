@@ -23,7 +23,7 @@ from ._schema import ENUMTBLNAME, MODELTBLNAME, FIELDTBLNAME
 from ._schema import MAPTBLNAME, PROPTBLNAME, SCHEMAVERSION
 from ._schema import enum_tabledef as _enum_tabledef
 from ._schema import create_timeline_view as _create_timeline_view
-from ._schema import create_fieldinfo_view as _create_fieldinfo_view
+from ._schema import create_fieldinfo_table as _create_fieldinfo_table
 from ._schema import timeline_fields as _timeline_fields
 from ._schema import validname as _validname
 
@@ -57,11 +57,13 @@ class Database:
     #########################
 
 
-    def __init__(s, dbname, prefix=DBPREFIX, pkey='id'):
-        ''' initialise the database object. '''
+    def __init__(s, dbname, prefix=DBPREFIX, pkey='id', readonly=False):
+        ''' initialise the database object. When readonly is True, the
+        database file is opened read-only (i.e. for loading only). '''
 
         # properties related to the database file and connection
         s.dbname = _os.path.abspath(_os.path.expanduser(dbname))
+        s.readonly = readonly
         s.connected = False
         s.hascursor = False
         s.loaded = False
@@ -118,6 +120,13 @@ class Database:
         elif s.connected is True:
             s.dbcur = s.dbcon.cursor()
             s.hascursor = True
+        elif s.readonly is True:
+            s.dbcon = _apsw.Connection(s.dbname, flags=_apsw.SQLITE_OPEN_READONLY)
+            s.dbcur = s.dbcon.cursor()
+            # also refuse writes to temporary tables and such
+            s.dbcur.execute('PRAGMA query_only=1')
+            s.connected = True
+            s.hascursor = True
         else:
             s.dbcon = _apsw.Connection(s.dbname)
             s.dbcur = s.dbcon.cursor()
@@ -167,7 +176,13 @@ class Database:
 
 
     def rollback_transaction(s):
-        ''' issue rollback on main database connection '''
+        ''' issue rollback on main database connection, returns True upon
+        success, or False when no transaction is active '''
+
+        # NOTE: autocommit mode means there is no active transaction, no need
+        #       to issue a ROLLBACK just to have it rejected by SQLite
+        if s.dbcon.getautocommit() is True:
+            return False
 
         try:
             s.dbcur.execute('ROLLBACK')
@@ -200,6 +215,8 @@ class Database:
             raise RuntimeError('you can either load or create a db')
         if s.created is True:
             raise RuntimeError('db already created. did you forget?')
+        if s.readonly is True:
+            raise RuntimeError('can not create a read-only db')
 
         directory = _os.path.split(s.dbname)[0]
         if not _os.path.isdir(directory):
@@ -236,8 +253,8 @@ class Database:
         for t in tbldefs:
             s._register_table(t, create=True)
 
-        # create static views
-        _create_fieldinfo_view(s)
+        # create the fieldinfo table and the timeline view
+        _create_fieldinfo_table(s)
         _create_timeline_view(s, s._excluded_from_timeline)
 
         # end transaction again
@@ -272,9 +289,17 @@ class Database:
         if isinstance(sv, str):
             msg = 'db schema {:s} != DADB schema {:d}'.format(sv, SCHEMAVERSION)
             raise _exceptions.VersionError(msg)
-        if sv != SCHEMAVERSION:
+        # schema 3 only differs in _fieldinfo_, which was a view instead of a
+        # table, so these databases are upgraded when loading them
+        # NOTE: read-only databases are not upgraded, the view yields the same
+        #       results, only slower
+        if sv == 3:
+            upgrade = s.readonly is False
+        elif sv != SCHEMAVERSION:
             msg = 'db schema {:d} != DADB schema {:d}'.format(sv, SCHEMAVERSION)
             raise _exceptions.VersionError(msg)
+        else:
+            upgrade = False
 
         api = getattr(res, 'apiversion')
         if api != APIVERSION:
@@ -284,6 +309,9 @@ class Database:
         timeline_blacklist = _literal_eval(getattr(res, 'timeline_blacklist'))
         s._excluded_from_timeline = [l.strip() for l in timeline_blacklist]
 
+        if upgrade is True:
+            s._upgrade_from_schema_3()
+
         # load the in memory representation of the operational and data tables
         tbldefs = [t for t in _operational_tables_]
         tbldefs.extend([s._add_prefix(t, s.prefix) for t in _data_tables_])
@@ -305,6 +333,30 @@ class Database:
         s.loaded = True
 
 
+    def _upgrade_from_schema_3(s):
+        ''' replaces the _fieldinfo_ view of a schema 3 database by a table
+
+        The timeline view is re-created as well, since it is built from the
+        _fieldinfo_ table, and the schema version is set to the current one.
+        '''
+
+        started_transaction = s.begin_transaction()
+
+        try:
+            s.dbcur.execute('DROP VIEW IF EXISTS _fieldinfo_')
+            _create_fieldinfo_table(s)
+            _create_timeline_view(s, s._excluded_from_timeline)
+            q = 'UPDATE {:s} SET schemaversion = ?'.format(_reserved_.name)
+            s.dbcur.execute(q, (SCHEMAVERSION,))
+        except:
+            if started_transaction is True:
+                s.rollback_transaction()
+            raise
+
+        if started_transaction is True:
+            s.end_transaction()
+
+
     def reload(s):
         ''' updates database object values by reloading database '''
 
@@ -514,7 +566,8 @@ class Database:
         Only support queries on single tables with an optional list of fields
         to select (default: None; this means all fields are selected) and an
         optional dictionary from which the WHERE clause is built
-        (default: None; this means no WHERE clause is built at all)
+        (default: None; this means no WHERE clause is built at all). When a
+        value in the where dictionary is a tuple, an IN clause is built.
 
         If you bring your own cursor, that will be used, otherwise we create a
         dedicated cursor for just this select, which may introduce some unknown
@@ -554,9 +607,18 @@ class Database:
         if where is not None:
             # make sure we have fields and values in same order
             wnames = [k for k in where.keys()]
-            wvals = tuple([where[n] for n in wnames])
+            wvals = []
+            clauses = []
+            for n in wnames:
+                if isinstance(where[n], tuple):
+                    clauses.append('%s IN (%s)' % (n, ', '.join('?'*len(where[n]))))
+                    wvals.extend(where[n])
+                else:
+                    clauses.append('%s is ?' % n)
+                    wvals.append(where[n])
+            wvals = tuple(wvals)
             # build the WHERE clause
-            where = 'WHERE ' + ' AND '.join(['%s is ?' % n for n in wnames])
+            where = 'WHERE ' + ' AND '.join(clauses)
             if orderby is not None:
                 where += ' ORDER BY {:s}'.format(orderby)
             query = 'SELECT {:s} FROM {:s} {:s};'.format(fields, tablename, where)
@@ -620,6 +682,13 @@ class Database:
         return s.data_manager.get_data(s.dbcon, id_)
 
 
+    def get_data_many(s, ids):
+        ''' returns a dictionary with the Data object for each of the given
+        ids. Ids that are None are ignored. '''
+
+        return s.data_manager.get_data_many(s.dbcon, ids)
+
+
     def data_by_sha256(s, sha256):
         ''' returns rowids of data objects with the given sha256 '''
 
@@ -716,6 +785,9 @@ class Database:
             rid = s._insert_values(tblname, int(val.value), val.name,
                                    cursor=s.dbcur)
 
+        # refresh the fieldinfo table, which resolves the enum tables
+        _create_fieldinfo_table(s)
+
         # we already have the appropriate information to create a table
         # descriptor, but instead we want to create a new underlying enum that
         # is created in this module and not in the import module. So instead we
@@ -784,6 +856,9 @@ class Database:
         q = 'DELETE FROM '+ENUMTBLNAME+' WHERE id_ == ?'
         s.dbcur.execute(q, (rowid,))
 
+        # refresh the fieldinfo table, which resolves the enum tables
+        _create_fieldinfo_table(s)
+
         # remove the enum from the enum dict
         discard = s.enums.pop(enumname)
 
@@ -1076,6 +1151,9 @@ class Database:
         q = 'DELETE FROM '+MODELTBLNAME+' WHERE id_ == ?'
         s.dbcur.execute(q, (rowid,))
 
+        # refresh the fieldinfo table, which is derived from these records
+        _create_fieldinfo_table(s)
+
         # remove the model table
         s._drop_table(tablename)
 
@@ -1166,6 +1244,59 @@ class Database:
         return rowid
 
 
+    def insert_modelitems(s, modelitems, nested=False):
+        ''' inserts a sequence of modelitems (and their subitems) into the
+        appropriate table(s) and returns a list with the rowids.
+
+        This is equivalent to calling insert_modelitem for each modelitem, but
+        all modelitems are inserted within a single transaction and the
+        checks and lookups that depend on the model only are performed once
+        per model, instead of once per modelitem.
+        '''
+
+        # the insert functions of the models encountered so far
+        inserters = {}
+        rowids = []
+
+        # make sure the insert as a whole is part of a transaction
+        # (either started by us or an already active transaction)
+        started_transaction = s.begin_transaction()
+        try:
+            for modelitem in modelitems:
+
+                # integers are assumed to be rowids of existing modelitems
+                if isinstance(modelitem, int):
+                    rowids.append(modelitem)
+                    continue
+
+                modelname = type(modelitem).__name__
+                inserter = inserters.get(modelname)
+                if inserter is None:
+                    # check if writing is allowed
+                    if modelname not in s._writing_allowed:
+                        msg = 'writing of modelitems for model {:s} is not allowed until you register the model'
+                        msg = msg.format(modelname)
+                        raise _exceptions.ReadOnlyModelError(msg)
+
+                    try:
+                        inserter = s.models[modelname].inserter
+                    except:
+                        raise ValueError('could not retrieve insert function for '
+                                         'modelitem {:s}'.format(modelname))
+                    inserters[modelname] = inserter
+
+                rowids.append(inserter(s.dbcon, modelitem, nested))
+        except:
+            if started_transaction is True:
+                s.rollback_transaction()
+            raise
+
+        if started_transaction is True:
+            s.end_transaction()
+
+        return rowids
+
+
     def hide_column_from_previews(s, fieldname, modelname=None):
         ''' hide column from compound fields in views '''
 
@@ -1187,6 +1318,8 @@ class Database:
             q = q.format(FIELDTBLNAME, FIELDTBLNAME)
             s.dbcur.execute(q, (fieldname,))
 
+        # refresh the fieldinfo table
+        _create_fieldinfo_table(s)
         # update the model descriptors by reloading database
         s.reload_db()
         # and re-create the timeline view
@@ -1203,6 +1336,8 @@ class Database:
             ''' SET preview_ = 1 WHERE '''+FIELDTBLNAME+'''.name_ == ?'''
 
         s.dbcur.execute(q, (fieldname,))
+        # refresh the fieldinfo table
+        _create_fieldinfo_table(s)
         # update model descriptors by reloading database
         s.reload_db()
         # and re-create the timeline view
@@ -1604,11 +1739,11 @@ class Database:
 
         for field_record in field_records:
             datatype = field_record.datatype_
-            nullable = bool(getattr(field_record, 'nullable_'))
-            multiple = bool(getattr(field_record, 'multiple_'))
-            submodel = getattr(field_record, 'submodel_')
-            enum_ = getattr(field_record, 'enum_')
-            preview = bool(getattr(field_record, 'preview_'))
+            nullable = bool(field_record.nullable_)
+            multiple = bool(field_record.multiple_)
+            submodel = field_record.submodel_
+            enum_ = field_record.enum_
+            preview = bool(field_record.preview_)
 
             if field_record.datatype_ is not None:
                 # the field contains a single normal datatype
@@ -1840,6 +1975,9 @@ class Database:
                 rec = rec(fieldrow, fd.proptable.datatype, ptname)
                 rowid = s._insert_record(PROPTBLNAME, rec, cursor=s.dbcur)
 
+        # refresh the fieldinfo table, which is derived from these records
+        _create_fieldinfo_table(s)
+
         if started_transaction is True:
             s.dbcur.execute('COMMIT')
 
@@ -130,7 +130,12 @@ def from_iso8601(string):
     elif not isinstance(string, str):
         raise _InvalidArgumentError("invald type passed to converter")
     elif 'T' in string:
-        return _dateutilparser.parse(string)
+        # fast path for the strings we store ourselves via isoformat (and, on
+        # python 3.11+, most other ISO 8601 strings), fall back to dateutil
+        try:
+            return _datetime.fromisoformat(string)
+        except ValueError:
+            return _dateutilparser.parse(string)
     elif '-' in string:
         # special case that is not handled the way I want by dateutil
         y,m,d = string.split('-')
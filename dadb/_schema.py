@@ -5,10 +5,15 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
 from collections import namedtuple as _nt
+from functools import lru_cache as _lru_cache
 
 # increment when changing these core tables 
 # (consider changing API level as well)
-SCHEMAVERSION = 3
+SCHEMAVERSION = 4
+
+# maximum number of columns to format in a single printf call in the timeline
+# view (SQLite allows at most 127 arguments per function call)
+PRINTF_MAXARGS = 100
 
 # names of the operational tables
 ENUMTBLNAME = '_enum_'
@@ -17,12 +22,40 @@ FIELDTBLNAME = '_field_'
 MAPTBLNAME = '_maptable_'
 PROPTBLNAME = '_proptable_'
 
+# the query to collect the properties for each field in the modeltables
+# (the tables pointed to are resolved via joins instead of correlated subqueries)
+_FIELDINFO_SQL = f'''
+        SELECT {MODELTBLNAME}.name_ as modelname_,
+               {MODELTBLNAME}.table_ as modeltable_,
+               {FIELDTBLNAME}.name_ as fieldname_,
+               {FIELDTBLNAME}.colname_ columnname_,
+               {FIELDTBLNAME}.datatype_ as datatype_,
+               {FIELDTBLNAME}.preview_ as preview_,
+               COALESCE(sm.table_, se.table_) as points_to_,
+               COALESCE(me.table_, mm.table_) as maps_to_,
+               {MAPTBLNAME}.maptable_ as mapping_table_,
+               {PROPTBLNAME}.proptable_ as property_table_,
+               {PROPTBLNAME}.datatype_ as property_datatype_
+        FROM {FIELDTBLNAME}
+        LEFT JOIN {MODELTBLNAME} on {FIELDTBLNAME}.modelid_ == {MODELTBLNAME}.id_
+        LEFT JOIN {MAPTBLNAME} on {FIELDTBLNAME}.id_ == {MAPTBLNAME}.field_
+        LEFT JOIN {PROPTBLNAME} on {FIELDTBLNAME}.id_ == {PROPTBLNAME}.field_
+        LEFT JOIN {MODELTBLNAME} sm on sm.id_ == {FIELDTBLNAME}.submodel_
+        LEFT JOIN {ENUMTBLNAME} se on se.id_ == {FIELDTBLNAME}.enum_
+        LEFT JOIN {ENUMTBLNAME} me on me.id_ == {MAPTBLNAME}.enum_
+        LEFT JOIN {MODELTBLNAME} mm on mm.id_ == {MAPTBLNAME}.model_
+        '''
+
 # structure for defining a column
 #
 # name:           column name
 # description:    documentation
 # coldef:         CREATE TABLE substatement to create the column
-col = _nt('col', 'name description coldef')
+#
+# NOTE: kept as (slotted) tuple, since tabledefs are compared, sorted and
+# modified with _replace when prefixing table and column names
+class col(_nt('col', 'name description coldef')):
+    __slots__ = ()
 
 # structure for defining a table
 #
@@ -30,7 +63,8 @@ col = _nt('col', 'name description coldef')
 # description:    documentation
 # fields:         a list of col elements as defined above
 # tblconstraint:  a table constraint passed verbatim into CREATE TABLE statement
-tbl = _nt('table', 'name description fields tblconstraint')
+class tbl(_nt('table', 'name description fields tblconstraint')):
+    __slots__ = ()
 
 
 # meta-metadata needed for dadb operations
@@ -99,8 +133,8 @@ _propertytable_ = tbl(PROPTBLNAME, 'descriptor for property fields', (
                       col('proptable_', 'name of property table', 'TEXT')),
                       'PRIMARY KEY (field_, proptable_)')
 
-# list of the 5 operational tables
-_operational_tables_ = [_enumtable_, _modeltable_, _fieldtable_, _maptable_, _propertytable_]
+# the 5 operational tables
+_operational_tables_ = (_enumtable_, _modeltable_, _fieldtable_, _maptable_, _propertytable_)
 
 
 # tables related to a data object
@@ -128,19 +162,30 @@ _blockmap_ = tbl('blockmap', 'maps blocks to data objects', (
                  col('offset', 'offset of block in data object', 'INTEGER NOT NULL')),
                  'PRIMARY KEY (dataid, offset)')
 
-# list of the 3 data tables
-_data_tables_ = [_data_, _block_, _blockmap_]
+# the 3 data tables
+_data_tables_ = (_data_, _block_, _blockmap_)
+
 
+# datatypes of the fields that are included in the timeline
+_TIMESTAMP_TYPES = ('Datetime', 'Date')
+_TIMESTAMP_WHERE = {'datatype_': _TIMESTAMP_TYPES}
 
+# datatypes of the fields that are never included in previews
+_SKIP_TYPES = frozenset(('Bytes', None, ''))
+
+# translation table for replacing special characters in SQLite names
+# NOTE: only two special characters are checked, 
+#       we probably need something more robust
+_VALIDNAME_TBL = str.maketrans({'.':'_', '+':'_'})
+
+
+# NOTE: the same names are converted over and over when registering and
+#       loading models, so cache the results
+@_lru_cache(maxsize=None)
 def validname(name, prefix='x'):
     ''' converts given string to a prefixed SQLite name '''
 
-    # NOTE: only two special characters are checked, 
-    #       we probably need something more robust
-    name = name.replace('.','_')
-    name = name.replace('+','_')
-
-    return '%s%s' % (prefix, name, )
+    return f'{prefix}{name.translate(_VALIDNAME_TBL)}'
 
 
 def enum_tabledef(prefix, tblname):
@@ -157,151 +202,154 @@ def enum_tabledef(prefix, tblname):
 def timeline_fields(db, excluded=None):
     ''' determine which fields to include in timeline '''
 
-    # select the fields with a Datetime or Date type
+    # fetch the Datetime and Date fields in a single query
     # (expand to list to prevent issues with nested queries)
-    dtfields = list(db.select('_fieldinfo_', where={'datatype_':'Datetime'},
-                    cursor=db.dbcur))
-    dfields = list(db.select('_fieldinfo_', where={'datatype_':'Date'},
-                   cursor=db.dbcur))
-
-    if excluded is not None:
-        if isinstance(excluded, list):
-            for mname in excluded:
-                if mname not in db.models:
-                    raise ValueError('timeline exclusion list contains invalid modelname')
-            dtfields = [f for f in dtfields if f.modelname_ not in excluded]
-            dfields = [f for f in dfields if f.modelname_ not in excluded]
-        else:
-            raise ValueError('expected list of modelnames to exclude from timeline')
+    fieldinfo = list(db.select('_fieldinfo_', where=_TIMESTAMP_WHERE, cursor=db.dbcur))
+
+    dtfields, dfields = _collect_timeline_fields(db, excluded, fieldinfo)
     return dtfields + dfields
 
 
+def _collect_timeline_fields(db, excluded, fieldinfo):
+    ''' returns the non-excluded Datetime and Date fields from fieldinfo '''
+
+    if excluded is None:
+        excluded = frozenset()
+    elif isinstance(excluded, list):
+        excluded = frozenset(excluded)
+        if not excluded.issubset(db.models):
+            raise ValueError('timeline exclusion list contains invalid modelname')
+    else:
+        raise ValueError('expected list of modelnames to exclude from timeline')
+
+    # select the fields with a Datetime or Date type
+    dtfields = []
+    dfields = []
+    for f in fieldinfo:
+        if f.modelname_ in excluded:
+            continue
+        if f.datatype_ == 'Datetime':
+            dtfields.append(f)
+        elif f.datatype_ == 'Date':
+            dfields.append(f)
+    return dtfields, dfields
+
+
 def create_timeline_view(db, excluded=None):
     ''' creates a timeline view in the given DADB database '''
 
-    # make sure it is all done, or nothing at all
-    started_transaction = db.begin_transaction()
-
-    q = 'DROP VIEW IF EXISTS {:s}Timeline_'.format(db.prefix)
-    db.dbcur.execute(q)
+    # make sure it is all done, or nothing at all, using a savepoint so that
+    # this also holds when the caller is already inside a transaction
+    db.dbcur.execute('SAVEPOINT timeline_')
+    try:
+        _create_timeline_view(db, excluded)
+    except:
+        db.dbcur.execute('ROLLBACK TO timeline_')
+        db.dbcur.execute('RELEASE timeline_')
+        raise
+    db.dbcur.execute('RELEASE timeline_')
+
+
+def _create_timeline_view(db, excluded):
+    ''' drops and re-creates the timeline view '''
+
+    # NOTE: the view is dropped in the same execute call as the re-creation
+    dropquery = 'DROP VIEW IF EXISTS {:s}Timeline_;'.format(db.prefix)
+
+    # iterate over the fieldinfo only once, keeping the candidate timestamp
+    # fields and indexing the preview columns per modeltable, skipping binary
+    # columns, columns with no values and columns hidden from previews
+    # NOTE: uses a dedicated cursor, so no need to expand to list first
+    tsfields = []
+    by_tbl = {}
+    for c in db.select('_fieldinfo_'):
+        if c.datatype_ in _TIMESTAMP_TYPES:
+            tsfields.append(c)
+        if c.datatype_ not in _SKIP_TYPES and bool(c.preview_) is True:
+            by_tbl.setdefault(c.modeltable_, []).append((c.fieldname_, c.columnname_))
 
     # select the fields with a Datetime or Date type
-    # (expand to list to prevent issues with nested queries)
-    dtfields = list(db.select('_fieldinfo_', where={'datatype_':'Datetime'},
-                    cursor=db.dbcur))
-    dfields = list(db.select('_fieldinfo_', where={'datatype_':'Date'},
-                   cursor=db.dbcur))
-
-    if excluded is not None:
-        if isinstance(excluded, list):
-            for mname in excluded:
-                if mname not in db.models:
-                    raise ValueError('timeline exclusion list contains invalid modelname')
-            dtfields = [f for f in dtfields if f.modelname_ not in excluded]
-            dfields = [f for f in dfields if f.modelname_ not in excluded]
-        else:
-            raise ValueError('expected list of modelnames to exclude from timeline')
+    dtfields, dfields = _collect_timeline_fields(db, excluded, tsfields)
 
     # create the model part of the query
-    subdt = [_modeltimeline_subquery(db, fd) for fd in dtfields]
-    subd = [_modeltimeline_subquery(db, fd) for fd in dfields]
     # NOTE: this will be empty if there is no modeldata or if there are no 
     # Datetime/Date fields in any of the models
-    allfields = subdt + subd
+    prefix = db.prefix
+    pkey = db.pkey
+    allfields = [_modeltimeline_subquery(fd, prefix, pkey, by_tbl) for fd in dtfields + dfields]
 
     if len(allfields) == 0:
-        if started_transaction is True:
-            db.dbcur.execute('COMMIT')
+        db.dbcur.execute(dropquery)
         return
 
     # build and execute the complete query
     # the name of the timeline table should also be prefixed
-    q = "CREATE VIEW {:s}Timeline_ AS {:s} ORDER BY timestamp_"
-    megaquery = q.format(db.prefix, '\n\nUNION\n\n'.join(allfields))
-    db.dbcur.execute(megaquery)
+    # NOTE: rows from different subqueries can not collide, so use UNION ALL
+    # to prevent a needless sort and deduplication pass
+    subqueries = '\nUNION ALL\n'.join(allfields)
+    megaquery = f"CREATE VIEW {db.prefix}Timeline_ AS {subqueries} ORDER BY timestamp_"
+    db.dbcur.execute(dropquery + megaquery)
 
-    # end transaction if we started it
-    if started_transaction is True:
-        db.dbcur.execute('COMMIT')
 
-
-def _modeltimeline_subquery(db, fd):
+def _modeltimeline_subquery(fd, prefix, pkey, by_tbl):
     ''' subqueries for getting timeinfo from models '''
 
-    # the base query for timeline view creation of a single datetime field
-    q = "SELECT {:s} AS timestamp_,\n '{:s}' AS timestampfield_,\n " +\
-            "'{:s}' AS table_\n, {:s}{:s}\n, {:s} AS preview_\n " +\
-        "FROM {:s} \nWHERE {:s} is not NULL"
-
-    # the columns to use in the timeline view
-    columns = db.select('_fieldinfo_',
-                        where={'modeltable_': getattr(fd, 'modeltable_')},
-                        cursor=db.dbcur)
+    col = fd.columnname_
+    tbl = fd.modeltable_
 
-    # skip binary columns and columns with no values
-    columns = filter(lambda c: getattr(c, 'datatype_') not in ['Bytes', None, ''], columns)
-    # and columns that should be hidden from previews
-    columns = filter(lambda c: bool(getattr(c, 'preview_')) is True, columns)
-    # and place the columnnames in a list
-    colnames = [(getattr(cc, 'fieldname_'), getattr(cc, 'columnname_')) for cc in columns]
+    # the (fieldname, columnname) tuples to use in the timeline view
+    colnames = by_tbl.get(tbl, [])
 
     if len(colnames) == 0:
         preview = "''"
     else:
-        # add CAST to String
-        colnames = ["'{:s}:' || COALESCE(CAST({:s} AS TEXT),'')\n".format(c[0],c[1]) for c in colnames]
-        # create the preview query
-        preview = " || '|' || ".join(colnames)
-
-    query = q.format(getattr(fd, 'columnname_'),
-                     getattr(fd, 'columnname_'),
-                     getattr(fd, 'modeltable_'),
-                     db.prefix, db.pkey, preview,
-                     getattr(fd, 'modeltable_'),
-                     getattr(fd, 'columnname_'))
-    return query
-
-
-def create_fieldinfo_view(db):
-    ''' creates a view with properties for each field in the modeltables.
-
-    It is best to call this function from within a transaction, but this is
-    not enforced.  '''
-
-    db.dbcur.execute('DROP VIEW IF EXISTS _fieldinfo_')
-    d = '''
-        CREATE VIEW _fieldinfo_ as
-        SELECT '''+MODELTBLNAME+'''.name_ as modelname_,
-               '''+MODELTBLNAME+'''.table_ as modeltable_,
-               '''+FIELDTBLNAME+'''.name_ as fieldname_,
-               '''+FIELDTBLNAME+'''.colname_ columnname_,
-               '''+FIELDTBLNAME+'''.datatype_ as datatype_,
-               '''+FIELDTBLNAME+'''.preview_ as preview_,
-               (SELECT CASE
-                  WHEN '''+FIELDTBLNAME+'''.submodel_ != ''
-                     THEN (SELECT table_ FROM '''+MODELTBLNAME+ \
-                           ''' WHERE id_ == '''+FIELDTBLNAME+'''.submodel_)
-                  WHEN '''+FIELDTBLNAME+'''.enum_ != ''
-                     THEN (SELECT table_ FROM '''+ENUMTBLNAME+ \
-                           ''' WHERE id_ == '''+FIELDTBLNAME+'''.enum_)
-               END) as points_to_,
-               (SELECT CASE
-                  WHEN '''+MAPTBLNAME+'''.enum_ != ''
-                     THEN (SELECT table_ FROM '''+ENUMTBLNAME+ \
-                           ''' WHERE id_ == '''+MAPTBLNAME+'''.enum_)
-                  WHEN '''+MAPTBLNAME+'''.model_ != ''
-                     THEN (SELECT table_ FROM '''+MODELTBLNAME+ \
-                           ''' WHERE id_ == '''+MAPTBLNAME+'''.model_)
-               END) as maps_to_,
-               '''+MAPTBLNAME+'''.maptable_ as mapping_table_,
-               '''+PROPTBLNAME+'''.proptable_ as property_table_,
-               '''+PROPTBLNAME+'''.datatype_ as property_datatype_
-        FROM '''+FIELDTBLNAME+ \
-                ''' LEFT JOIN '''+MODELTBLNAME+ \
-                ''' on '''+FIELDTBLNAME+'''.modelid_ == '''+MODELTBLNAME+'''.id_
-        LEFT JOIN '''+MAPTBLNAME+''' on '''+FIELDTBLNAME+ \
-                '''.id_ == '''+MAPTBLNAME+'''.field_
-        LEFT JOIN '''+PROPTBLNAME+''' on '''+ \
-                FIELDTBLNAME+'''.id_ == '''+PROPTBLNAME+'''.field_;
-        '''
-    db.dbcur.execute(d)
+        # create the preview query with printf calls, with the fieldnames in
+        # the format string (escaping any literal %). SQLite limits the number
+        # of arguments of a function, so use a printf call for each group of
+        # at most PRINTF_MAXARGS columns and concatenate these
+        groups = []
+        for i in range(0, len(colnames), PRINTF_MAXARGS):
+            group = colnames[i:i+PRINTF_MAXARGS]
+            fmt = '|'.join(f"{fname.replace('%', '%%')}:%s" for fname, _ in group)
+            # add CAST to String
+            args = ", ".join(f"COALESCE(CAST({cname} AS TEXT),'')" for _, cname in group)
+            groups.append(f"printf('{fmt}', {args})")
+        preview = " || '|' || ".join(groups)
+
+    # the query for timeline view creation of a single datetime field
+    return (f"SELECT {col} AS timestamp_,\n '{col}' AS timestampfield_,\n "
+            f"'{tbl}' AS table_\n, {prefix}{pkey}\n, {preview} AS preview_\n "
+            f"FROM {tbl} \nWHERE {col} is not NULL")
+
+
+def create_fieldinfo_table(db):
+    ''' creates a table with properties for each field in the modeltables.
+
+    The table is a materialized version of the fieldinfo query, so it is
+    re-created after each write to the metadata tables used in that query.
+    The table is (re)created within a transaction, unless we are already
+    inside a transaction.  '''
+
+    # make sure it is all done, or nothing at all
+    started_transaction = db.begin_transaction()
+
+    # NOTE: the _fieldinfo_ table replaced the view used up to schema 3. The
+    #       table is not updated by older DADB versions, which is why the
+    #       schema version was incremented (the view of a schema 3 database
+    #       is replaced when it is loaded, see Database.load)
+    db.dbcur.execute('DROP TABLE IF EXISTS _fieldinfo_')
+
+    # re-create the table and its indexes in a single execute call
+    db.dbcur.execute('CREATE TABLE _fieldinfo_ AS ' + _FIELDINFO_SQL + ';' +
+                     'CREATE INDEX _fieldinfo_modeltable_ ON _fieldinfo_(modeltable_);' +
+                     'CREATE INDEX _fieldinfo_datatype_ ON _fieldinfo_(datatype_)')
+
+    # index the columns that point to other models and enums
+    for tblname, colname in ((FIELDTBLNAME, 'submodel_'), (FIELDTBLNAME, 'enum_'),
+                             (MAPTBLNAME, 'enum_'), (MAPTBLNAME, 'model_')):
+        q = 'CREATE INDEX IF NOT EXISTS {:s}{:s}idx ON {:s}({:s})'
+        db.dbcur.execute(q.format(tblname, colname, tblname, colname))
+
+    # end transaction if we started it
+    if started_transaction is True:
+        db.dbcur.execute('COMMIT')
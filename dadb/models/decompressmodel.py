@@ -507,20 +507,22 @@ def _tool_runner(input_data, params):
         try:
             proc = _subprocess.Popen(command_list, stdout=_subprocess.PIPE,
                                      stderr=_subprocess.PIPE)
-            stdout = [l.decode().rstrip() for l in proc.stdout]
-            stderr = [l.decode().rstrip() for l in proc.stderr]
+            # NOTE: communicate drains both pipes concurrently (reading them
+            #       one after another may deadlock when the tool fills the
+            #       stderr pipe) and waits for the process to finish
+            stdout, stderr = proc.communicate()
         finally:
             # make sure we cleanup the input file
             _os.unlink(infile.name)
 
-        if stdout != [] or stderr != []:
+        if stdout != b'' or stderr != b'':
             try:
                 # attempt to unlink output file if it exists
                 _os.unlink(outname)
             except FileNotFoundError:
                 pass
             # raise a DecompressError with the output from stderr
-            raise DecompressError(' '.join(stderr))
+            raise DecompressError(' '.join([l.rstrip() for l in stderr.decode().splitlines()]))
 
         return outname
 
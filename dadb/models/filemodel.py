@@ -238,6 +238,21 @@ def get(db, object_id):
         return None
 
 
+def get_data_stream(db, object_id):
+    ''' returns the Data object of the file with the given object_id, or None
+    if the file has no data or does not exist
+
+    This avoids constructing the full modelitem, when only the data is needed.
+    '''
+
+    q = _data_query(db)
+    c = db.dbcon.cursor()
+    res = c.execute(q, (object_id,)).fetchall()
+    if len(res) == 0:
+        return None
+    return db.get_data(res[0][0])
+
+
 def get_by_path(db, name_pattern, with_pkey=False):
     ''' generates a sequence of file modelitems with the given name pattern
 
@@ -411,6 +426,7 @@ def has_data(db, file_):
 # module global variables to store specific queries
 _GETPATH_QUERY = None
 _GETSIZE_QUERY = None
+_GETDATA_QUERY = None
 
 
 def _get_filetype(value):
@@ -460,3 +476,23 @@ def _size_query(db):
     q = q.format(idcol, tbl, sizecol, sizecol, sizecol)
     _GETSIZE_QUERY = q
     return _GETSIZE_QUERY
+
+
+def _data_query(db):
+    ''' (construct and) get query to fetch the data id of a file '''
+
+    # use cached version if available
+    global _GETDATA_QUERY
+    if _GETDATA_QUERY is not None:
+        return _GETDATA_QUERY
+
+    tbl = db.get_tblname(MODELNAME)
+    idcol = db.get_colname(MODELNAME)
+    datacol = db.get_colname(MODELNAME, 'data')
+    q = '''SELECT {:s}
+           FROM {:s}
+           WHERE {:s} == ?'''
+
+    q = q.format(datacol, tbl, idcol)
+    _GETDATA_QUERY = q
+    return _GETDATA_QUERY
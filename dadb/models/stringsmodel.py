@@ -5,11 +5,14 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
 import multiprocessing as _multiprocessing
+from multiprocessing.shared_memory import SharedMemory as _SharedMemory
+from multiprocessing import resource_tracker as _resource_tracker
 import apsw as _apsw
-import subprocess as _subprocess
 from collections import namedtuple as _nt
+from functools import lru_cache as _lru_cache
 import re as _re
 import os as _os
+import queue as _queue
 from enum import Enum as _Enum
 
 from .. import Database as _Database
@@ -61,8 +64,10 @@ modeldef = _model_def(MODELNAME,
 # search results (with offset, lenght and bytes)
 _searchres = _nt('search_result', 'fileid offset length bytes')
 
-# blocksize to use when running the strings command (default 50MB)
+# blocksize to use when collecting strings output (default 50MB)
 BLOCKSIZE=50*1024*1024
+# size of the windows in which a block is scanned for the first search term
+LITERAL_WINDOW=1024*1024
 
 # default max size of a search hit when searching for string patterns
 DEFAULT_HIT_SPAN=4096
@@ -70,9 +75,37 @@ DEFAULT_HIT_SPAN=4096
 # upper limit of the size of individual search hits
 MAX_HIT_SPAN=16384
 
+# strings output of at least this size is passed from the worker processes to
+# the main process via shared memory instead of via the result queue
+SHM_THRESHOLD=1024*1024
+
+# number of results that are inserted per transaction in _update_multiproc
+COMMIT_INTERVAL=256
+
+# number of results for which the records are inserted at once
+INSERT_BATCHSIZE=512
+
+# connection settings for bulk inserts (the database is already in WAL mode),
+# in WAL mode synchronous=NORMAL is safe from corruption and avoids the fsync
+# on each commit (the original settings are restored after the update)
+_BULK_PRAGMAS = (('synchronous', 'NORMAL'),
+                 ('temp_store', 'MEMORY'),
+                 ('cache_size', '-262144'))
+
 # encodings to try when scanning files with regexes to find exact matches
 encodings = ['ascii', 'utf8', 'latin_1', 'utf16']
 
+# regexes to find runs of at least 4 printable characters (or tabs), equal
+# to the output of the strings command for the given encoding (-e option)
+_STRINGS_REGEXES = {'s': _re.compile(rb'[\t\x20-\x7e]{4,}'),
+                    'S': _re.compile(rb'[\t\x20-\x7e\x80-\xff]{4,}'),
+                    'l': _re.compile(rb'(?:[\t\x20-\x7e]\x00){4,}')}
+
+# the encodings (-e option of strings) for which strings are collected
+_ENCODINGS = {'s': StringType.Sevenbit,
+              'S': StringType.Eightbit,
+              'l': StringType.LittleEndian16bit}
+
 
 #######
 # API #
@@ -92,7 +125,7 @@ def insert(db, fileid):
     '''
 
     # check if the file has already been processed
-    query = _rowid_by_fileid_query(db)
+    query = _rowid_by_fileid_query(_model_names(db))
     results = _get_rowids(db, fileid, query)
     if results != None:
         return results
@@ -116,26 +149,11 @@ def insert(db, fileid):
     rowids = []
 
     try:
-        # 7-bit strings
-        for offset, results, error in _process_file(f, encoding='s'):
-            m = db.make_modelitem(MODELNAME, file=fileid, offset=offset,
-                                  encoding=StringType.Sevenbit,
-                                  error=error, strings=results)
-            rowid = db.insert_modelitem(m)
-            rowids.append(rowid)
-
-        # 8-bit strings
-        for offset, results, error in _process_file(f, encoding='S'):
+        # 7-bit, 8-bit and 16-bit little endian strings, collected in a
+        # single pass over the file data
+        for offset, encoding, results, error in _process_file(f, _ENCODINGS):
             m = db.make_modelitem(MODELNAME, file=fileid, offset=offset,
-                                  encoding=StringType.Eightbit,
-                                  error=error, strings=results)
-            rowid = db.insert_modelitem(m)
-            rowids.append(rowid)
-
-        # 16-bit little endian strings
-        for offset, results, error in _process_file(f, encoding='l'):
-            m = db.make_modelitem(MODELNAME, file=fileid, offset=offset,
-                                  encoding=StringType.LittleEndian16bit,
+                                  encoding=_ENCODINGS[encoding],
                                   error=error, strings=results)
             rowid = db.insert_modelitem(m)
             rowids.append(rowid)
@@ -167,7 +185,15 @@ def items(db, with_pkey=False):
 
 
 def update(db, progress=False):
-    ''' collect strings for unprocessed files '''
+    ''' collect strings for unprocessed files
+
+    NOTE: the results of the small files are committed in chunks of
+    COMMIT_INTERVAL files. When an error occurs (or the update is
+    interrupted), the results that are already committed are kept, so the
+    strings table then holds the results of only part of the files. These
+    files are skipped when update is called again, which processes the
+    remaining files.
+    '''
 
     db.check_registered(MODELNAME)
 
@@ -188,46 +214,17 @@ def update(db, progress=False):
     if len(todolist) == 0:
         return
 
-    # First process the large files in the main thread. The rationale here is
-    # that with multiprocessing, the results need to be communicated between the
-    # sub threads and the main thread and we want to prevent having to place very
-    # large result sets into the queue. So we only process files that are
-    # smaller than the chosen blocksize via multiprocessing.
-
-    # results into the result queue
-    large_files = []
-    for fid in todolist:
-        f = db.modelitem(_filemodel.MODELNAME, fid)
-        if f.size > BLOCKSIZE:
-            large_files.append(fid)
-
-    if progress is True:
-        # create a fake sequence wrapped in progresswrapper
-        todolist = _progresswrapper(large_files, '{:20s}'.format('    strings (large files)'))
-
-    # insert the results into the database in one transaction
-    db.begin_transaction()
+    # configure the connection for the bulk inserts, but restore the original
+    # settings afterwards, since the connection is not ours
+    orig_pragmas = _set_pragmas(db, _BULK_PRAGMAS)
     try:
-        for fileid in todolist:
-            insert(db, fileid)
-    except:
-        db.rollback_transaction()
-        raise
-    db.end_transaction()
+        _update(db, todolist, progress)
+    finally:
+        _set_pragmas(db, orig_pragmas)
 
-    # next, process the small files using multiprocessing
-    _update_multiproc(db, progress)
 
-    # rebuild the FTS index
-    if _has_fts(db):
-        if progress is True:
-            print('    rebuilding FTS5 index...', end='', flush=True)
-        _rebuild_fts_index(db)
-        if progress is True:
-            print('done')
-
-
-def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPAN):
+def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPAN,
+           processes=None):
     ''' search for the given search terms all the files in the database
 
     Arguments:
@@ -236,6 +233,8 @@ def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPA
     - use_fts    : if True, use full text search (FTS) instead of LIKE queries
     - files_only : instead of yielding individual hits, yield file ids
     - max_span   : the max size of the search hit (default 4K, max 16K)
+    - processes  : scan the blocks of files larger than BLOCKSIZE with this
+                   many worker processes (default None, scan in this process)
 
     Search works as follows:
 
@@ -251,8 +250,8 @@ def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPA
     Caveats:
 
     - Isolated strings (strings separated by non-printable characters) smaller
-      than 4 characters can not be found, since the strings command used to
-      detect strings in file data uses a minimal length of 4 characters.
+      than 4 characters can not be found, since strings are detected in file
+      data using a minimal length of 4 characters (like the strings command).
 
     - When search terms separated by asterisks (*) are so far apart that the
       entire result length exceeds max_span, the results will not be yielded.
@@ -261,7 +260,7 @@ def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPA
       when using FTS search (use_fts=True). See additional comments below.
 
     - Files are scanned for seven bit, eight bit and 16 bit little-endian
-      encodings, via the strings command. Other encodings (big-endian, 32-bit)
+      encodings, like the strings command. Other encodings (big-endian, 32-bit)
       are not indexed, so we can not search for those.
 
     - Candidate files are scanned via regexes using ascii, utf8, latin_1 and
@@ -270,54 +269,90 @@ def search(db, string, use_fts=False, files_only=False, max_span=DEFAULT_HIT_SPA
     Additional notes on FTS search:
 
     Using FTS may speed up the search significantly (if a search index has been
-    created first). However, you should be aware that in this case a tokenizer
-    is used that may result in missing some results. This is caused by the fact
-    that the FTS index contains keywords (separated by the tokenizer) and that
-    we can only match our search terms on the entire keyword (or at the start
-    of a keyword if an asterisk is used after the search term).
-
-    As a consequence: using FTS one can not find terms that (only) occur
-    somewhere in the middle of some larger keyword. To illustrate: when a file
-    contains the word 'somestring', using FTS we can not find it by searching
-    for 'mestri', whereas it can be found using the slower search without FTS.
-
-    In addition to this, when separating two terms with an asterisk (*) in the
-    search string, the FTS search only considers results where these terms are
-    indeed two separate tokens. To illustrate, when searching for the terms
-    'content*protection', the result that contains 'contentprotection' will not
-    be found via the FTS search. It can, however, be found using the slower
-    search without FTS
+    created first). The index is created with the trigram tokenizer, which
+    means that search terms can be found anywhere in the strings output, also
+    in the middle of some larger keyword (i.e. 'mestri' in 'somestring').
+
+    Search terms shorter than 3 characters can not be looked up in a trigram
+    index, so these are not used when selecting candidate files via FTS (but
+    they are still part of the exact match on the file data). When none of
+    the search terms is at least 3 characters long, the slower search without
+    FTS is used instead.
+
+    An FTS index created by an older version of this model uses a tokenizer
+    that only matches search terms on entire keywords (or at the start of a
+    keyword). Such an index is still used as is, but it is replaced by a
+    trigram index when calling enable_fts again.
+    '''
+
+    if max_span > MAX_HIT_SPAN:
+        raise ValueError('max_span can not exceed {:d}!'.format(MAX_HIT_SPAN))
+    if max_span < 1:
+        raise ValueError('max_span should be at least 1!')
+
+    if files_only is False:
+        # yield the results of the batches as individual search results
+        for id_, offsets, lengths, data in search_batch(db, string, use_fts,
+                                                        max_span, processes):
+            for offset, length, bytes_ in zip(offsets, lengths, data):
+                yield _searchres(id_, offset, length, bytes_)
+        return
+
+    # for each candidate determine if there are any search hits
+    for id_ in _search_candidates(db, string, use_fts):
+        has_match = _get_matches(db, id_, string, max_span, True, processes)
+        if has_match:
+            yield id_
+    return
+
+
+def search_batch(db, string, use_fts=False, max_span=DEFAULT_HIT_SPAN, processes=None):
+    ''' search for the given search terms in all the files in the database,
+    like search, but yield the hits per file as a tuple of lists:
+
+        (fileid, offsets, lengths, data)
+
+    where the lists are sorted by offset and data contains the bytes of the
+    search hits. Files without search hits are not yielded.
     '''
 
     if max_span > MAX_HIT_SPAN:
         raise ValueError('max_span can not exceed {:d}!'.format(MAX_HIT_SPAN))
+    if max_span < 1:
+        raise ValueError('max_span should be at least 1!')
+
+    # for each candidate determine the location of search hits
+    for id_ in _search_candidates(db, string, use_fts):
+        ranges = _get_matches(db, id_, string, max_span, processes=processes)
+        if len(ranges) == 0:
+            continue
+        ranges.sort()
+        offsets = [r[0] for r in ranges]
+        lengths = [r[1] for r in ranges]
+        # get the file only once for all ranges
+        f = _filemodel.get(db, id_)
+        data = []
+        for offset, length in ranges:
+            f.data.seek(offset)
+            data.append(f.data.read(length))
+        yield id_, offsets, lengths, data
+
+
+def _search_candidates(db, string, use_fts):
+    ''' return the ids of the files that may contain the search terms '''
 
     if use_fts is False:
         # first find files that contain the given search terms
-        candidates = _get_candidates(db, string)
-    else:
-        if not _has_fts(db):
-            raise ValueError('enable FTS before using use_fts=True')
+        return _get_candidates(db, string)
 
-        phrase = _string_to_fts_phrase(string)
-        candidates = _fts_candidates(db, phrase)
+    if not _has_fts(db):
+        raise ValueError('enable FTS before using use_fts=True')
 
-    # for each candidate determine the location of search hits
-    for id_ in candidates:
-        if files_only is True:
-            has_match = _get_matches(db, id_, string, max_span, True)
-            if has_match:
-                yield id_
-                continue
-        else:
-            ranges = _get_matches(db, id_, string, max_span)
-            ranges.sort()
-            for offset, length in ranges:
-                f = _filemodel.get(db, id_)
-                f.data.seek(offset)
-                data = f.data.read(length)
-                yield _searchres(id_, offset, length, data)
-    return
+    phrase = _string_to_fts_phrase(string, _has_trigram_fts(db))
+    if phrase is None:
+        # no terms that can be looked up in the FTS index
+        return _get_candidates(db, string)
+    return _fts_candidates(db, phrase)
 
 
 def enable_fts(db, progress=False):
@@ -336,6 +371,9 @@ def enable_fts(db, progress=False):
 ##################
 
 
+# NOTE: the same regexes are needed for each candidate file in a search,
+#       so cache them instead of building and compiling them per file
+@_lru_cache(maxsize=64)
 def _build_regexes(string, hit_span):
     ''' create regular expressions to search for given string '''
 
@@ -357,63 +395,165 @@ def _build_regexes(string, hit_span):
     filler = '.{{0,{:d}}}?'.format(max_distance)
     filler = filler.encode()
 
-    # create regex for each encoding
-    regexes = []
+    # create pattern for each encoding
+    patterns = set()
+    ignorecase = False
     for enc in encodings:
         try:
             if enc == 'utf16':
                 terms = [c.encode(enc)[2:] for c in components]
-                regex = filler.join(terms)
             else:
                 terms = [c.encode(enc) for c in components]
-                regex = filler.join(terms)
-            # compile with DOTALL flags to make sure we match string
-            # patterns that contain non-printables and with IGNORECASE
-            # to match on lower and upper case hits
-            regexes.append(_re.compile(regex,flags=_re.S|_re.I))
+            if all([_REGEX_SPECIALS.isdisjoint(t) for t in terms]):
+                # literal terms, fold case at compile time
+                pattern = filler.join([_expand_case(t) for t in terms])
+                flags = _re.S
+            else:
+                # terms are used as regular expression, which we can't
+                # expand safely, so let the regex engine fold case
+                pattern = filler.join(terms)
+                flags = _re.S|_re.I
+            # skip patterns that are not valid on their own
+            _re.compile(pattern, flags=flags)
+        except:
+            continue
+        if flags & _re.I:
+            ignorecase = True
+        patterns.add(pattern)
+
+    if len(patterns) == 0:
+        return ()
+
+    # fuse the (distinct) patterns into a single alternation, so that each
+    # block is scanned only once for all encodings
+    regex = b'|'.join([b'(?:' + p + b')' for p in sorted(patterns)])
+
+    # compile with DOTALL flags to make sure we match string
+    # patterns that contain non-printables, and only with IGNORECASE
+    # (to match on lower and upper case hits) when one of the patterns
+    # could not be expanded. The expanded patterns match the same with
+    # or without IGNORECASE.
+    # (use a tuple, since the cached result is shared between calls)
+    flags = _re.S
+    if ignorecase is True:
+        flags |= _re.I
+    return (_re.compile(regex, flags=flags),)
+
+
+def _expand_case(term):
+    ''' return pattern that matches the given literal term in any case
+
+    NOTE: like IGNORECASE on a bytes pattern, this only folds ASCII letters
+    '''
+
+    out = []
+    for c in term:
+        if 0x41 <= c <= 0x5a or 0x61 <= c <= 0x7a:
+            out.append(bytes([0x5b, c, c ^ 0x20, 0x5d]))
+        else:
+            out.append(bytes([c]))
+    return b''.join(out)
+
+
+# bytes that have a special meaning in a regular expression
+_REGEX_SPECIALS = frozenset(b'.^$*+?{}[]\\|()')
+
+
+@_lru_cache(maxsize=64)
+def _build_literals(string):
+    ''' return the lowercase encoded forms of the first search term, which
+    each search hit should start with, or None if the term is not literal '''
+
+    components = [c for c in string.split('*') if c != '']
+    if len(components) == 0:
+        return None
+
+    first = components[0]
+    literals = set()
+    for enc in encodings:
+        try:
+            if enc == 'utf16':
+                term = first.encode(enc)[2:]
+            else:
+                term = first.encode(enc)
         except:
-            regexes.append(None)
+            continue
+        if not _REGEX_SPECIALS.isdisjoint(term):
+            # term is used as regular expression, can't use as literal
+            return None
+        literals.add(term.lower())
+
+    if len(literals) == 0:
+        return None
+    return tuple(literals)
+
+
+def _first_literal(block, literals):
+    ''' return offset of first occurrence of any of the given literals in the
+    block (ignoring case), or None if none of the literals occur '''
 
-    # drop empty and equal regexes
-    regexes = list(set([r for r in regexes if r is not None]))
-    return regexes
+    if literals is None:
+        return 0
 
+    # NOTE: lower the block per window, to prevent copying the entire block
+    #       (twice). The windows overlap, so that literals that cross the
+    #       window boundary are found as well
+    view = memoryview(block)
+    overlap = max([len(literal) for literal in literals]) - 1
 
-def _get_matches(db, fileid, string, max_span, has_match_only=False):
+    for start in range(0, len(view), LITERAL_WINDOW):
+        # IGNORECASE on a bytes pattern only folds ASCII, same as bytes.lower()
+        lowered = bytes(view[start:start+LITERAL_WINDOW+overlap]).lower()
+        first = None
+        for literal in literals:
+            pos = lowered.find(literal)
+            if pos != -1 and (first is None or pos < first):
+                first = pos
+        if first is not None:
+            return start + first
+
+    return None
+
+
+def _get_matches(db, fileid, string, max_span, has_match_only=False, processes=None):
     ''' return (offset, size) tuples for each search hit in file data '''
 
     # check if max_span does not exceed maximum
     if max_span > MAX_HIT_SPAN:
         raise ValueError("max_span is limited to {:d}".format(MAX_HIT_SPAN))
-
-    regexes = _build_regexes(string, max_span)
+    if max_span < 1:
+        raise ValueError("max_span should be at least 1")
 
     # get the file
     f = _filemodel.get(db, fileid)
 
-    # read the first block
-    block = f.data.read(BLOCKSIZE)
-    blockstart = 0
-    # keep track of the unique matches in all blocks
+    # scan the blocks of large files in parallel when asked for, but only
+    # when there is no active transaction, since the worker processes use
+    # their own database connection and would not see uncommitted data
+    if (processes is not None and processes > 1 and f.size > BLOCKSIZE and
+        db.dbcon.getautocommit()):
+        return _get_matches_multiproc(db, fileid, f.size, string, max_span,
+                                      has_match_only, processes)
+
+    regexes = _build_regexes(string, max_span)
+    literals = _build_literals(string)
+
+    # keep track of the unique matches in all blocks, which overlap
+    # by max_span bytes to find matches on the block boundaries
     unique_matches = set()
-    while block != b'':
-        # get the current position
-        pos = f.data.tell()
+    for blockstart, block in _iter_blocks(f, max_span):
+        # a (much cheaper) literal search for the first term tells us where
+        # the first hit can start, or if the block can be skipped entirely
+        pos = _first_literal(block, literals)
+        if pos is None:
+            continue
         if has_match_only is True:
-            if _block_has_match(block, regexes, max_span):
+            if _block_has_match(block, regexes, max_span, pos):
                 return True
         else:
-            sub_matches = _scan_block(block, blockstart, regexes, max_span)
-            unique_matches = unique_matches.union(sub_matches)
-
-        # abort if we have reached the end of the file
-        if pos == f.size:
-            break
-
-        # seek back max_span bytes and read the next block
-        blockstart = pos - max_span
-        f.data.seek(blockstart)
-        block = f.data.read(BLOCKSIZE)
+            # NOTE: update in place, instead of creating a new set via
+            #       union for each block (which copies all earlier matches)
+            unique_matches.update(_scan_block(block, blockstart, regexes, max_span, pos))
 
     if has_match_only is True:
         return False
@@ -421,27 +561,58 @@ def _get_matches(db, fileid, string, max_span, has_match_only=False):
         return list(unique_matches)
 
 
-def _scan_block(block, offset, regexes, max_span):
+def _iter_blocks(f, overlap):
+    ''' yield (offset, block) tuples for the data of the given file, where
+    subsequent blocks of (at most) BLOCKSIZE bytes overlap by overlap bytes
+
+    NOTE: to prevent copying and re-reading the overlapping part, each block
+    is a memoryview on a single re-used buffer. This means that a block is
+    only valid until the next block is requested.
+    '''
+
+    size = f.size
+    if size == 0:
+        return
+
+    # read the first block
+    buf = bytearray(min(size, BLOCKSIZE))
+    view = memoryview(buf)
+    f.data.seek(0)
+    f.data.readinto(buf)
+    yield 0, view
+
+    # file offset up to which we have read
+    end = len(buf)
+    while end < size:
+        # move the overlap to the start of the buffer and fill the rest
+        # NOTE: buf[-0:] is the entire buffer, which would resize buf
+        if overlap > 0:
+            buf[:overlap] = buf[-overlap:]
+        toread = min(len(buf) - overlap, size - end)
+        f.data.readinto(view[overlap:overlap+toread])
+        blockstart = end - overlap
+        end += toread
+        yield blockstart, view[:overlap+toread]
+
+
+def _scan_block(block, offset, regexes, max_span, pos=0):
     ''' search the given block for given regexes '''
 
     unique_matches = set()
 
     for regex in regexes:
-        matches = regex.finditer(block)
-        for match in matches:
-            start,end = match.span()
-            if end-start > max_span:
-                # result is too long, skip
-                continue
-            unique_matches.add((start+offset, end-start))
+        spans = [match.span() for match in regex.finditer(block, pos)]
+        # skip results that are too long
+        unique_matches.update([(start+offset, end-start) for start, end in spans
+                               if end-start <= max_span])
     return unique_matches
 
 
-def _block_has_match(block, regexes, max_span):
+def _block_has_match(block, regexes, max_span, pos=0):
     ''' search the given block for given regexes '''
 
     for regex in regexes:
-        matches = regex.finditer(block)
+        matches = regex.finditer(block, pos)
         for match in matches:
             start,end = match.span()
             if end-start > max_span:
@@ -456,6 +627,142 @@ def _block_has_match(block, regexes, max_span):
 ################
 
 
+def _block_starts(size, overlap, blocksize):
+    ''' return the start offsets of the blocks yielded by _iter_blocks '''
+
+    starts = [0]
+    while starts[-1] + blocksize < size:
+        starts.append(starts[-1] + blocksize - overlap)
+    return starts
+
+
+def _get_matches_multiproc(db, fileid, size, string, max_span, has_match_only, processes):
+    ''' scan the blocks of a large file via multiprocessing
+
+    NOTE: the re module does not release the GIL while scanning, so threads
+    would not help here. Instead, each worker process reads the blocks it
+    scans from its own database connection, so that only the block offsets
+    and results are passed between the processes.
+    '''
+
+    starts = _block_starts(size, max_span, BLOCKSIZE)
+    processes = min(processes, len(starts))
+
+    task_queue = _multiprocessing.Queue()
+    done_queue = _multiprocessing.Queue()
+    # set when a hit is found, so that remaining blocks can be skipped
+    # when we are only interested in whether there is any hit at all
+    found = _multiprocessing.Event()
+
+    for blockstart in starts:
+        task_queue.put(blockstart)
+    for i in range(processes):
+        task_queue.put('STOP')
+
+    # Start worker processes
+    workers = []
+    for i in range(processes):
+        p = _multiprocessing.Process(target=_block_worker,
+                                     args=(db.dbname, fileid, string, max_span,
+                                           has_match_only, BLOCKSIZE,
+                                           task_queue, done_queue, found))
+        workers.append(p)
+        p.start()
+
+    # collect the results (one for each block)
+    # NOTE: a worker can die without putting a result for the block it took
+    #       (i.e. when it is killed by the OOM killer), so don't wait forever
+    results = []
+    while len(results) < len(starts):
+        try:
+            results.append(done_queue.get(timeout=1))
+        except _queue.Empty:
+            dead = [p.exitcode for p in workers if p.exitcode not in (None, 0)]
+            if len(dead) > 0:
+                for p in workers:
+                    p.terminate()
+                    p.join()
+                msg = 'block worker exited with exitcode {:d}'.format(dead[0])
+                raise RuntimeError(msg)
+
+    # make sure all worker processess are cleaned up
+    for p in workers:
+        p.join()
+
+    for res in results:
+        if isinstance(res, str):
+            raise RuntimeError('block worker failed: {:s}'.format(res))
+
+    if has_match_only is True:
+        return found.is_set()
+
+    unique_matches = set()
+    for sub_matches in results:
+        unique_matches.update(sub_matches)
+    return list(unique_matches)
+
+
+def _block_worker(dbname, fileid, string, max_span, has_match_only, blocksize,
+                  input, output, found):
+    ''' scan blocks of a file in a worker process
+
+    NOTE: exceptions are passed to the main process as their repr() string,
+    since not all exceptions can be pickled. The main process waits for a
+    result for each block, so when the setup fails, the error is passed as
+    result of each block this worker takes.
+    '''
+
+    subdb = None
+    error = None
+    try:
+        # make new read-only connection to the database, which also means
+        # that we do not register the models
+        subdb = _Database(dbname, readonly=True)
+        subdb.load()
+
+        regexes = _build_regexes(string, max_span)
+        literals = _build_literals(string)
+
+        f = _filemodel.get(subdb, fileid)
+        if f is None:
+            raise ValueError('no file with id {:d}'.format(fileid))
+    except Exception as e:
+        error = repr(e)
+
+    for blockstart in iter(input.get, 'STOP'):
+        if error is not None:
+            output.put(error)
+            continue
+
+        if found.is_set():
+            # we already have a hit, skip remaining blocks
+            output.put(None)
+            continue
+
+        # NOTE: pass exceptions to the main process, which would otherwise
+        #       wait forever for the result of this block
+        try:
+            f.data.seek(blockstart)
+            block = f.data.read(min(blocksize, f.size - blockstart))
+
+            pos = _first_literal(block, literals)
+            if has_match_only is True:
+                if pos is not None and _block_has_match(block, regexes, max_span, pos):
+                    found.set()
+                output.put(None)
+            elif pos is None:
+                output.put(set())
+            else:
+                output.put(_scan_block(block, blockstart, regexes, max_span, pos))
+        except Exception as e:
+            output.put(repr(e))
+
+    # not really needed, since process will be killed, but do it anyway
+    if subdb is not None:
+        subdb.close()
+    subdb = None
+
+
 def _like_query(search_string):
     ''' convert the given search term(s) to LIKE query '''
 
@@ -478,7 +785,7 @@ def _get_candidates(db, string):
     db.check_registered(MODELNAME)
 
     # perform the SQLite query to get files with a match
-    q = _candidate_query(db)
+    q = _candidate_query(_model_names(db))
     c = db.dbcon.cursor()
     c.execute(q, (qstring,))
 
@@ -486,16 +793,12 @@ def _get_candidates(db, string):
         yield fileid[0]
 
 
-def _candidate_query(db):
+@_lru_cache(maxsize=None)
+def _candidate_query(names):
     ''' return query to get files with specific strings '''
 
-    tbl = db.get_tblname(MODELNAME)
-    idcol = db.get_colname(MODELNAME)
-    filecol = db.get_colname(MODELNAME, 'file')
-    stringcol = db.get_colname(MODELNAME, 'strings')
-
     q = 'SELECT {:s} FROM {:s} WHERE {:s} LIKE ? GROUP BY {:s}'
-    return q.format(filecol, tbl, stringcol, filecol)
+    return q.format(names.filecol, names.tbl, names.stringcol, names.filecol)
 
 
 ###############
@@ -503,31 +806,49 @@ def _candidate_query(db):
 ###############
 
 
-def _has_fts(db):
-    ''' return True if fts is enabled '''
+def _fts_sql(db):
+    ''' return the statement that created the fts index, or None '''
 
-    tblname = db.get_tblname(MODELNAME)
+    tblname = _model_names(db).tbl
 
     # check if an fts_strings table already exists
-    Q = "SELECT * FROM sqlite_master WHERE name = 'fts_{:}'".format(tblname)
+    Q = "SELECT sql FROM sqlite_master WHERE name = 'fts_{:}'".format(tblname)
     res = list(db.dbcur.execute(Q))
     if len(res) > 0:
-        return True
-    return False
+        return res[0][0]
+    return None
+
+
+def _has_fts(db):
+    ''' return True if fts is enabled '''
+
+    return _fts_sql(db) is not None
+
+
+def _has_trigram_fts(db):
+    ''' return True if the fts index uses the trigram tokenizer '''
+
+    sql = _fts_sql(db)
+    return sql is not None and "tokenize='trigram'" in sql
 
 
 def _create_fts_index(db):
     ''' create a fts5 index on the strings table '''
 
-    if _has_fts(db):
+    sql = _fts_sql(db)
+    if sql is not None and "tokenize='trigram'" in sql:
         return
 
-    # the query to create an external content table
-    Q = "CREATE VIRTUAL TABLE fts_{:} USING fts5({:}, content='{:}', content_rowid='{:}');"
-    tblname = db.get_tblname(MODELNAME)
-    content_rowid = db.get_colname(MODELNAME)
-    strings_fld = db.get_colname(MODELNAME, 'strings')
-    Q = Q.format(tblname,strings_fld, tblname, content_rowid)
+    names = _model_names(db)
+    if sql is not None:
+        # index created by an older model version, replace it
+        db.dbcur.execute('DROP TABLE fts_{:};'.format(names.tbl))
+
+    # the query to create an external content table, using the trigram
+    # tokenizer so that terms can be found in the middle of keywords
+    Q = ("CREATE VIRTUAL TABLE fts_{:} USING fts5({:}, content='{:}', "
+         "content_rowid='{:}', tokenize='trigram');")
+    Q = Q.format(names.tbl, names.stringcol, names.tbl, names.idcol)
     db.dbcur.execute(Q)
 
 
@@ -539,25 +860,62 @@ def _rebuild_fts_index(db):
 
     Q = "INSERT INTO fts_{:}(fts_{:}) VALUES('rebuild')list;"
     Q = "INSERT INTO fts_{:}(fts_{:}) VALUES('rebuild');"
-    tblname = db.get_tblname(MODELNAME)
+    tblname = _model_names(db).tbl
     Q = Q.format(tblname,tblname)
     db.dbcur.execute(Q)
 
 
-def _string_to_fts_phrase(string):
-    ''' convert the search string to a proper FTS phrase '''
+def _max_rowid(db):
+    ''' return the highest rowid in the strings table (or 0 if empty) '''
+
+    names = _model_names(db)
+    Q = 'SELECT max({:s}) FROM {:s}'.format(names.idcol, names.tbl)
+    res = next(db.dbcon.cursor().execute(Q))[0]
+    if res is None:
+        return 0
+    return res
+
+
+def _update_fts_index(db, rowid):
+    ''' add the strings records with a rowid larger than given rowid to the
+    fts index, which is possible since rowids are (strictly) increasing '''
+
+    names = _model_names(db)
+    Q = '''INSERT INTO fts_{:s}(rowid, {:s})
+           SELECT {:s}, {:s} FROM {:s} WHERE {:s} > ?'''
+    Q = Q.format(names.tbl, names.stringcol, names.idcol, names.stringcol,
+                 names.tbl, names.idcol)
+    db.dbcur.execute(Q, (rowid,))
+
+
+def _string_to_fts_phrase(string, trigram=True):
+    ''' convert the search string to a proper FTS phrase, returns None if
+    there are no terms that can be looked up in a trigram index '''
 
     # translate the provided keyword(s) into a FTS query
     components = string.split('*')
     # remove empty components (if wildcard is at start or end)
     components = [c for c in components if c != '']
-    # add quotes to each component
-    components = ['"'+c+'"' for c in components]
-    # combine into a single fts_query
-    phrase = '*'.join(components)
-    # add a final asterisk to allow last token to be prefix token
-    phrase += '*'
-    return phrase
+
+    if trigram is False:
+        # legacy index: add quotes to each component
+        components = ['"'+c+'"' for c in components]
+        # combine into a single fts_query
+        phrase = '*'.join(components)
+        # add a final asterisk to allow last token to be prefix token
+        phrase += '*'
+        return phrase
+
+    # terms of less than 3 characters do not match anything in a trigram
+    # index, so leave these out (the exact match is done on the data anyway)
+    components = [c for c in components if len(c) >= 3]
+    if len(components) == 0:
+        return None
+
+    # quote each component (escaping double quotes) and require all of them,
+    # the trigram tokenizer matches each of them anywhere in the strings
+    components = ['"'+c.replace('"', '""')+'"' for c in components]
+    return ' AND '.join(components)
 
 
 def _fts_candidates(db, fts_query):
@@ -573,27 +931,24 @@ def _fts_candidates(db, fts_query):
     should be escaped SQL-style, by adding a second double-quote.
     '''
 
-    tblname = db.get_tblname(MODELNAME)
-    q = "SELECT rowid FROM fts_{:} WHERE fts_{:} MATCH ?"
-    q = q.format(tblname, tblname, fts_query)
+    # NOTE: the fts index uses the primary key of the strings table as
+    #       content_rowid, so we can join the matching fts rows with the
+    #       strings table to get the fileids in a single query
+    q = _fts_candidate_query(_model_names(db))
     dbcur = db.dbcon.cursor()
-    # the rowids of the string entries
-    rowids = [r[0] for r in dbcur.execute(q, (fts_query,))]
-    # get the rowids of the corresponding files
-    q = 'SELECT {:s} FROM {:s} WHERE {:s} == ?'
-    tbl = db.get_tblname(MODELNAME)
-    idcol = db.get_colname(MODELNAME)
-    filecol = db.get_colname(MODELNAME, 'file')
-    stringcol = db.get_colname(MODELNAME, 'strings')
-    q = q.format(filecol, tblname, idcol, filecol)
-    fileids = set()
-    for r in rowids:
-        res = list(dbcur.execute(q, (r,)))
-        if len(res) != 1:
-            raise ValueError('expected single result')
-        fileids.add(res[0][0])
-    for r in fileids:
-        yield r
+    for r in dbcur.execute(q, (fts_query,)):
+        yield r[0]
+
+
+@_lru_cache(maxsize=None)
+def _fts_candidate_query(names):
+    ''' return query to get files of the strings matching a fts query '''
+
+    q = '''SELECT DISTINCT {:s}.{:s} FROM fts_{:s}
+           JOIN {:s} ON {:s}.{:s} == fts_{:s}.rowid
+           WHERE fts_{:s} MATCH ?'''
+    tbl = names.tbl
+    return q.format(tbl, names.filecol, tbl, tbl, tbl, names.idcol, tbl, tbl)
 
 
 ######################
@@ -601,13 +956,38 @@ def _fts_candidates(db, fts_query):
 ######################
 
 
-def _rowid_by_fileid_query(db):
+# table and column names of the strings model, used to build the queries
+_model_names_t = _nt('model_names', 'tbl idcol filecol stringcol')
+
+
+def _model_names(db):
+    ''' return the table and column names of the strings model in given db '''
+
+    return _model_names_t(db.get_tblname(MODELNAME),
+                          db.get_colname(MODELNAME),
+                          db.get_colname(MODELNAME, 'file'),
+                          db.get_colname(MODELNAME, 'strings'))
+
+
+
+# NOTE: the queries only depend on the table and column names, so we
+#       cache them by names instead of building them on each call
+@_lru_cache(maxsize=None)
+def _rowid_by_fileid_query(names):
     ''' build the query to fetch rowids by filied '''
+    q = 'SELECT {:s} FROM {:s} WHERE {:s} == ?'
+    return q.format(names.idcol, names.tbl, names.filecol)
+
+
+def _insert_records_query(db):
+    ''' build the query to insert the records of strings modelitems directly
+    into the model table, which is only possible since all fields of the
+    model are direct fields '''
     # get field and table names
     mtbl = db.get_tblname(MODELNAME)
-    mfid = db.get_colname(MODELNAME, 'file')
-    mkey = db.get_colname(MODELNAME)
-    return 'SELECT {:s} FROM {:s} WHERE {:s} == ?'.format(mkey, mtbl, mfid)
+    fields = ('file', 'offset', 'encoding', 'error', 'strings')
+    cols = ', '.join([db.get_colname(MODELNAME, f) for f in fields])
+    return 'INSERT INTO {:s}({:s}) VALUES (?, ?, ?, ?, ?)'.format(mtbl, cols)
 
 
 def _get_rowids(db, fileid, query):
@@ -621,24 +1001,39 @@ def _get_rowids(db, fileid, query):
 
 
 def _process_block(block, encoding='s'):
-    ''' feed a single block (bytes) into the strings command '''
+    ''' collect the strings in a single block (bytes)
 
-    # run the strings command on the given block
-    proc = _subprocess.Popen(['strings', '-e', encoding],
-                             stdin=_subprocess.PIPE, stdout=_subprocess.PIPE,
-                             stderr=_subprocess.PIPE)
-    stdout, stderr = proc.communicate(block)
+    This produces the same output as the strings command with the given
+    encoding (-e option), but without the overhead of running a subprocess
+    and piping the block through it.
+    '''
 
-    # decode the error if present
     error = None
-    if stderr != b'':
+    if encoding not in _STRINGS_REGEXES:
         # prevent processing broken output, return with error
-        return None, stderr.decode()
+        return None, 'unsupported encoding: {:s}'.format(encoding)
+
+    # find the runs of printable characters
+    runs = _STRINGS_REGEXES[encoding].findall(block)
 
     # if output is empty, return results
-    if stdout == b'':
+    if len(runs) == 0:
         return None, error
 
+    # each string is terminated by a newline
+    runs.append(b'')
+    if encoding == 'l':
+        # 16 bit strings are output as their low bytes only, so join with a
+        # 16 bit newline and take the low bytes of the output in one go
+        # instead of slicing each run separately
+        stdout = b'\n\x00'.join(runs)[::2]
+    else:
+        stdout = b'\n'.join(runs)
+
+    # release the individual runs before decoding, so that we don't keep
+    # three copies of the output in memory at the same time
+    del runs
+
     # if we get here, we have output, attempt to decode it
     try:
         output = stdout.decode('utf8')
@@ -659,15 +1054,25 @@ def _process_block(block, encoding='s'):
     return output, error
 
 
-def _process_file(f, encoding='s'):
-    ''' process the file in a blockwise manner '''
+def _process_file(f, encodings=('s',)):
+    ''' process the file in a blockwise manner, yielding an (offset, encoding,
+    output, error) tuple for each of the given encodings
+
+    NOTE: all encodings are processed in the same pass over the data, so
+          that each block is read only once
+    '''
 
     # reset read pointer
     f.data.seek(0)
 
     if f.size < BLOCKSIZE:
-        out, err = _process_block(f.data.read(), encoding)
-        yield 0, out, err
+        # read directly into a buffer sized to the file, instead of via read(),
+        # which allocates an extra copy of the data
+        buf = bytearray(f.size)
+        f.data.readinto(buf)
+        for encoding in encodings:
+            out, err = _process_block(buf, encoding)
+            yield 0, encoding, out, err
         return
 
     # Due to reading in a block-wise manner, we need to take
@@ -687,33 +1092,87 @@ def _process_file(f, encoding='s'):
     # we might still miss strings that are longer than MAX_HIT_SPAN at the
     # block boundary, so we make sure MAX_HIT_SPAN is sufficiently large.
 
-    # start at offset 0
-    block_offset = 0
+    for block_offset, block in _iter_blocks(f, MAX_HIT_SPAN):
+        for encoding in encodings:
+            result, error = _process_block(block, encoding)
+
+            if result is not None:
+                yield block_offset, encoding, result, error
 
-    # continue while we have blocks to process
-    while block_offset < f.size:
 
-        # read the current block
-        f.data.seek(block_offset)
-        block = f.data.read(BLOCKSIZE)
-        result, error = _process_block(block, encoding)
+def _set_pragmas(db, pragmas):
+    ''' apply the given (name, value) pragmas to the database connection and
+    return the original (name, value) pairs '''
 
-        if result is not None:
-            yield block_offset, result, error
+    orig = []
+    for name, value in pragmas:
+        current = db.dbcur.execute('PRAGMA {:s}'.format(name)).fetchone()[0]
+        orig.append((name, str(current)))
+        db.dbcur.execute('PRAGMA {:s}={:s}'.format(name, value))
+    return tuple(orig)
 
-        # check if we processed the last block
-        if block_offset + len(block) == f.size:
-            return
 
-        # move to the next block
-        block_offset += len(block) - MAX_HIT_SPAN
+def _update(db, todolist, progress=False):
+    ''' collect strings for the given unprocessed files '''
+
+    # First process the large files in the main thread. The rationale here is
+    # that with multiprocessing, the results need to be communicated between the
+    # sub threads and the main thread and we want to prevent having to place very
+    # large result sets into the queue. So we only process files that are
+    # smaller than the chosen blocksize via multiprocessing.
+
+    # results into the result queue
+    large_files = []
+    for fid in todolist:
+        f = db.modelitem(_filemodel.MODELNAME, fid)
+        if f.size > BLOCKSIZE:
+            large_files.append(fid)
+
+    # only the large files are processed here
+    todolist = large_files
+    if progress is True:
+        # create a fake sequence wrapped in progresswrapper
+        todolist = _progresswrapper(large_files, '{:20s}'.format('    strings (large files)'))
+
+    # The FTS index is an external content table, which is not updated when
+    # records are inserted in the strings table. Instead of rebuilding the
+    # entire index afterwards, we only add the records inserted below.
+    if _has_fts(db):
+        fts_rowid = _max_rowid(db)
+    else:
+        fts_rowid = None
+
+    try:
+        # insert the results into the database in one transaction
+        db.begin_transaction()
+        try:
+            for fileid in todolist:
+                insert(db, fileid)
+        except:
+            db.rollback_transaction()
+            raise
+        db.end_transaction()
+
+        # next, process the small files using multiprocessing
+        _update_multiproc(db, progress)
+
+    finally:
+        # NOTE: _update_multiproc commits in chunks, so also index the
+        #       records that are already committed when an error occurs
+        if fts_rowid is not None:
+            if progress is True:
+                print('    updating FTS5 index...', end='', flush=True)
+            _update_fts_index(db, fts_rowid)
+            if progress is True:
+                print('done')
 
 
 def _update_multiproc(db, progress=False):
     ''' run strings on small files via multiprocessing '''
 
-    # use all cores minus 2
-    processes = _multiprocessing.cpu_count() - 2
+    # use all cores minus 2, but at least one worker (otherwise we would wait
+    # forever for the results)
+    processes = max(_multiprocessing.cpu_count() - 2, 1)
 
     # collect the todolist
     todolist = list(_unprocessed_file_ids(db))
@@ -732,21 +1191,39 @@ def _update_multiproc(db, progress=False):
     for fileid in todolist:
         task_queue.put(fileid)
 
-    # construct the get_by_fileid query only once
-    query = _rowid_by_fileid_query(db)
+    # make sure the workers share our resource tracker, so that the shared
+    # memory blocks they create are no longer tracked once we unlink them
+    _resource_tracker.ensure_running()
 
     # Start worker processes
     workers = []
     for i in range(processes):
-        p = _multiprocessing.Process(target=_multiproc_worker, args=(db, task_queue, done_queue, query))
+        p = _multiprocessing.Process(target=_multiproc_worker, args=(db, task_queue, done_queue))
         workers.append(p)
         p.start()
 
-    # insert the results into the database in one transaction
+    # insert the results into the database in chunks of COMMIT_INTERVAL
+    # results per transaction, to bound the size of the WAL file
     db.begin_transaction()
 
+    # The results are inserted as plain records in batches via executemany,
+    # instead of creating and inserting a modelitem for each result. This
+    # is possible since the model has only direct fields, which are stored
+    # as is, except for the encoding enum (for which we use the value) and
+    # the file (which is given as rowid).
+    cursor = db.dbcon.cursor()
+    insert_query = _insert_records_query(db)
+    sevenbit = StringType.Sevenbit.value
+    eightbit = StringType.Eightbit.value
+    le16bit = StringType.LittleEndian16bit.value
+    pending = []
+
     # collect the results
+    # NOTE: the shared memory blocks of a result are only released when the
+    #       result is read with _from_shared, so keep track of the current
+    #       result in order to release its blocks when an error occurs
     c = 0
+    res = None
     try:
         for i in range(len(todolist)):
             res = done_queue.get()
@@ -754,25 +1231,28 @@ def _update_multiproc(db, progress=False):
             if progress is True:
                 # update the progress counter
                 next(counter)
-            if res is None:
-                continue
-            # create and insert the 7bit result modelitem
-            m = db.make_modelitem(MODELNAME, file=res[0], offset=0,
-                                  encoding=StringType.Sevenbit,
-                                  error=res[2], strings=res[1])
-            rowid = db.insert_modelitem(m)
-            # create and insert the 8bit result modelitem
-            m = db.make_modelitem(MODELNAME, file=res[0], offset=0,
-                                  encoding=StringType.Eightbit,
-                                  error=res[4], strings=res[3])
-            rowid = db.insert_modelitem(m)
-            # create and insert the 16bit le result modelitem
-            m = db.make_modelitem(MODELNAME, file=res[0], offset=0,
-                                  encoding=StringType.LittleEndian16bit,
-                                  error=res[6], strings=res[5])
-            rowid = db.insert_modelitem(m)
+            # add the 7bit, 8bit and 16bit le result records
+            pending.append((res[0], 0, sevenbit, res[2], _from_shared(res[1])))
+            pending.append((res[0], 0, eightbit, res[4], _from_shared(res[3])))
+            pending.append((res[0], 0, le16bit, res[6], _from_shared(res[5])))
+            res = None
+            if len(pending) >= INSERT_BATCHSIZE or c % COMMIT_INTERVAL == 0:
+                cursor.executemany(insert_query, pending)
+                pending.clear()
+            if c % COMMIT_INTERVAL == 0:
+                # NOTE: committed results are skipped when update is
+                # called again, so no need to roll these back on error
+                db.end_transaction()
+                db.begin_transaction()
+
+        # insert the remaining records
+        cursor.executemany(insert_query, pending)
     except:
         db.rollback_transaction()
+        # release the shared memory of the current and the remaining results
+        if res is not None:
+            _release_shared(res)
+        _abort_workers(workers, task_queue, done_queue)
         raise
 
     db.end_transaction()
@@ -799,19 +1279,17 @@ def _update_multiproc(db, progress=False):
         p.join()
 
 
-def _multiproc_worker(db, input, output, query):
+def _multiproc_worker(db, input, output):
     ''' run strings on a single file '''
 
-    # make new connection to the database, make sure to only
-    # access read-only by not registering the models
-    subdb = _Database(db.dbname)
+    # make new read-only connection to the database, which also means
+    # that we do not register the models
+    subdb = _Database(db.dbname, readonly=True)
     subdb.load()
 
+    # NOTE: the todolist only contains unprocessed files, so there is
+    #       no need to check if results already exist for the file
     for fileid in iter(input.get, 'STOP'):
-        existing = _get_rowids(subdb, fileid, query)
-        if existing is not None:
-            output.put(None)
-            continue
 
         # get the file, or raise exception if model or item does not exist
         f = subdb.modelitem(_filemodel.MODELNAME, fileid)
@@ -831,32 +1309,22 @@ def _multiproc_worker(db, input, output, query):
         elif f.data.stored is False:
             pass
         else:
-            sevenbit = list(_process_file(f, encoding='s'))
-            eightbit = list(_process_file(f, encoding='S'))
-            le16bit = list(_process_file(f, encoding='l'))
-            # TODO: can we drop these checks for optimization?
-            if len(sevenbit) != 1:
-                raise ValueError("expected only single result")
-            if len(eightbit) != 1:
-                raise ValueError("expected only single result")
-            if len(le16bit) != 1:
-                raise ValueError("expected only single result")
-
-            offset, sevenbit_o, sevenbit_e = sevenbit[0]
-            # TODO: can we drop this check?
-            if offset != 0:
-                raise ValueError("expected offset 0")
-            offset, eightbit_o, eightbit_e = eightbit[0]
-            # TODO: can we drop this check?
-            if offset != 0:
-                raise ValueError("expected offset 0")
-            offset, le16bit_o, le16bit_e = le16bit[0]
-            # TODO: can we drop this check?
-            if offset != 0:
-                raise ValueError("expected offset 0")
-
-        output.put((fileid, sevenbit_o, sevenbit_e, eightbit_o,
-                    eightbit_e, le16bit_o, le16bit_e))
+            results = {}
+            for offset, encoding, out, err in _process_file(f, _ENCODINGS):
+                # TODO: can we drop these checks for optimization?
+                if encoding in results:
+                    raise ValueError("expected only single result")
+                if offset != 0:
+                    raise ValueError("expected offset 0")
+                results[encoding] = (out, err)
+
+            sevenbit_o, sevenbit_e = results['s']
+            eightbit_o, eightbit_e = results['S']
+            le16bit_o, le16bit_e = results['l']
+
+        output.put((fileid, _to_shared(sevenbit_o), sevenbit_e,
+                    _to_shared(eightbit_o), eightbit_e,
+                    _to_shared(le16bit_o), le16bit_e))
 
     # not really needed, since process will be killed, but do it anyway
     subdb.close()
@@ -865,6 +1333,87 @@ def _multiproc_worker(db, input, output, query):
     output.put('DONE')
 
 
+def _abort_workers(workers, task_queue, done_queue):
+    ''' stop the worker processes after an error, releasing the shared memory
+    blocks of the results that are not collected yet '''
+
+    # skip the files that are not processed yet
+    try:
+        while True:
+            task_queue.get_nowait()
+    except _queue.Empty:
+        pass
+    for p in workers:
+        task_queue.put('STOP')
+
+    # collect the remaining results until all workers are done (or gone, i.e.
+    # when they are interrupted as well)
+    # NOTE: a block created by a worker that is killed before it could put
+    #       the result in the queue is unlinked by the resource tracker
+    done = 0
+    while done < len(workers):
+        try:
+            res = done_queue.get(timeout=1)
+        except _queue.Empty:
+            if not any([p.is_alive() for p in workers]):
+                break
+            continue
+        if res == 'DONE':
+            done += 1
+        else:
+            _release_shared(res)
+
+    for p in workers:
+        p.join()
+
+
+def _to_shared(output):
+    ''' place large strings output in shared memory, returning a tuple with
+    the name and size of the shared memory block instead of the output '''
+
+    if output is None or len(output) < SHM_THRESHOLD:
+        return output
+
+    data = output.encode('utf8')
+    shm = _SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    # NOTE: the shared memory block is unlinked by the receiving process
+    shm.close()
+    return shm.name, len(data)
+
+
+def _from_shared(output):
+    ''' get strings output from shared memory and release the block '''
+
+    if not isinstance(output, tuple):
+        return output
+
+    name, size = output
+    shm = _SharedMemory(name=name)
+    try:
+        with shm.buf[:size] as buf:
+            return str(buf, 'utf8')
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _release_shared(result):
+    ''' release the shared memory blocks of the given worker result without
+    reading the strings output '''
+
+    for output in result[1:7:2]:
+        if not isinstance(output, tuple):
+            continue
+        try:
+            shm = _SharedMemory(name=output[0])
+        except FileNotFoundError:
+            # already released by _from_shared
+            continue
+        shm.close()
+        shm.unlink()
+
+
 def _unprocessed_file_ids(db):
     ''' generates file_ids that are not yet processed '''
 
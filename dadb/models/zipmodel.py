@@ -6,11 +6,20 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 
 import zipfile as _zipfile
 import os as _os
+import io as _io
+import mmap as _mmap
+import threading as _threading
+from collections import deque as _deque
+from collections import namedtuple as _nt
+from itertools import islice as _islice
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
 import re as _re
 import fnmatch as _fnmatch
+import json as _json
+from functools import lru_cache as _lru_cache
 from datetime import datetime as _datetime
 from pytz import utc as _utc
-from struct import unpack as _unpack
+from struct import Struct as _Struct
 
 from .. import model_definition as _model_def
 from .. import field_definition as _field_def
@@ -47,8 +56,35 @@ modeldef = _model_def(MODELNAME,
                       implicit_dedup=True, fail_on_dup=True)
 
 
+# the metadata of an extracted zip entry, as generated by _extract_files
+_zipentry = _nt('zipentry', 'path size mtime atime ctime btime uid gid inode '
+                'device external_attr internal_attr is_dir data_id password')
+
+# precompiled structs for parsing the extra field of zip entries
+_HEADER = _Struct('<HH')
+_U32 = _Struct('<I')
+_INODE = _Struct('<QI')
+_UX8 = _Struct('<LL')
+_UX12 = _Struct('<LLHH')
+_UXVERSION = _Struct('<BB')
+_UXUID = _Struct('<IB')
+
 # files that can be extracted using zipmodel
-ZIP_MIMES = ['application/zip', 'application/java-archive']
+ZIP_MIMES = frozenset(('application/zip', 'application/java-archive'))
+
+# number of extracted entries for which the file modelitems are inserted at once
+INSERT_BATCHSIZE = 512
+
+# zipfiles stored in the database up to this size are read into memory at
+# once, instead of being read via the Data object
+INMEMORY_MAXSIZE = 67108864  # 64MB
+
+# when extracting a memory mapped (or in memory) zipfile, the data of members up to
+# PREFETCH_MAXSIZE bytes is decompressed ahead in PREFETCH_THREADS threads,
+# with at most PREFETCH_WINDOW members kept in memory per thread
+PREFETCH_THREADS = 4
+PREFETCH_MAXSIZE = 8388608  # 8MB
+PREFETCH_WINDOW = 4
 
 
 #######
@@ -65,6 +101,13 @@ def register_with_db(db):
     _libmagicmodel.register_with_db(db)
     db.register_model(modeldef)
 
+    # index the columns used to find the unprocessed files
+    for modelname, fieldname in ((MODELNAME, 'file'), (_fparentmodel.MODELNAME, 'parent')):
+        table = db.get_tblname(modelname)
+        column = db.get_colname(modelname, fieldname)
+        q = 'CREATE INDEX IF NOT EXISTS {:s}{:s}idx ON {:s}({:s})'
+        db.dbcur.execute(q.format(table, column, table, column))
+
 
 def insert_local_file(db, filename, whitelist=None, progress=False):
     ''' insert a local file directly as zip-file, return (fileid, zipid)
@@ -210,6 +253,7 @@ def extracted_files(db, only_pkey=False):
 
 # global variables to hold some of the queries used
 _BY_FILEID_QUERY = None
+_UNPROCESSED_QUERY = None
 
 
 def _insert(db, fileid, fobj=None, whitelist=None, progress=False, sep='/', icall=False):
@@ -225,17 +269,33 @@ def _insert(db, fileid, fobj=None, whitelist=None, progress=False, sep='/', ical
         whitelist_field = None
     else:
         partial = True
-        whitelist_field = repr(whitelist)
+        # the order of the patterns is not relevant, so store a canonical
+        # representation of the whitelist
+        whitelist_field = _json.dumps(sorted(whitelist))
 
     try:
         if fobj is None:
-            zf = _open_zip_from_db(db, fileid, do_checks, do_magic)
+            zf, buf = _open_zip_from_db(db, fileid, do_checks, do_magic)
         else:
             zf = _open_zip_from_fileobj(fobj)
+            # members of memory mapped zipfiles can be read concurrently
+            if isinstance(fobj, _mmap.mmap):
+                buf = fobj
+            else:
+                buf = None
         if zf is None:
             return None
         # extract the zip and log an error if it fails
-        rowids = _unzip(db, zf, fileid, sep, whitelist, progress)
+        # NOTE: the file modelitems are inserted while extracting, so use a
+        #       savepoint to undo the partial extraction when an error occurs
+        db.dbcur.execute('SAVEPOINT unzip')
+        try:
+            rowids = _unzip(db, zf, fileid, sep, whitelist, progress, buf)
+        except:
+            db.dbcur.execute('ROLLBACK TO unzip')
+            raise
+        finally:
+            db.dbcur.execute('RELEASE unzip')
     except Exception as e:
         # create modelitem with the error
         m = db.make_modelitem(MODELNAME, file=fileid, contents=None,
@@ -265,23 +325,29 @@ def _insert(db, fileid, fobj=None, whitelist=None, progress=False, sep='/', ical
 
 
 def _open_zip_from_db(db, fileid, do_checks=True, do_magic=True):
-    ''' return given file as ZipFile object '''
+    ''' return given file as (ZipFile, buffer) tuple, where buffer holds the
+    data of the zipfile when it is read into memory (or None otherwise)
 
-    # get the file with the given fileid
-    f = _fmodel.get(db, fileid)
+    Returns (None, None) if the file can not be opened as zipfile. '''
 
     # check if the file exists and contains any data
     if do_checks is True:
+        # get the file with the given fileid
+        f = _fmodel.get(db, fileid)
         if f is None:
-            return
+            return None, None
         if f.ftype.value != _fmodel.Filetype.regular_file.value:
-            return None
+            return None, None
         if f.size == 0:
-            return None
+            return None, None
         if f.data is None:
-            return None
+            return None, None
         if f.data.stored is False:
-            return None
+            return None, None
+        data = f.data
+    else:
+        # we only need the data, not the full file modelitem
+        data = _fmodel.get_data_stream(db, fileid)
 
     # check if this is a ZIP type
     if do_magic is True:
@@ -290,15 +356,23 @@ def _open_zip_from_db(db, fileid, do_checks=True, do_magic=True):
             _libmagicmodel.insert(db, fileid)
             filemagic = _libmagicmodel.get_by_fileid(db, fileid)
         if filemagic.mimetype not in ZIP_MIMES:
-            return None
+            return None, None
 
     # make sure we start at the beginning
-    if f.data.seekable() is True:
-        f.data.seek(0)
+    if data.seekable() is True:
+        data.seek(0)
+
+    # Reading the central directory and the member headers requires a lot of
+    # seeks and small reads. For smaller zipfiles, read the data into memory
+    # at once, so that these are simple memory accesses (and the members can
+    # be read concurrently), instead of reads via the Data object.
+    if data.length <= INMEMORY_MAXSIZE:
+        buf = data.read()
+        return _zipfile.ZipFile(_BufferReader(buf)), buf
 
     # try if we can open the file as a zipfile
     # (will raise BadZipFile error upon failure)
-    return _zipfile.ZipFile(f.data)
+    return _zipfile.ZipFile(data), None
 
 
 def _open_zip_from_fileobj(fileobj):
@@ -312,19 +386,19 @@ def _open_zip_from_fileobj(fileobj):
     return _zipfile.ZipFile(fileobj)
 
 
-def _unzip(db, zf, fileid, sep, whitelist, progress):
+def _unzip(db, zf, fileid, sep, whitelist, progress, buf=None):
     ''' extract the given ZipFile object '''
 
-    # extract the file data and store as Data objects in the database
-    # while collecting the metadata in a list
-    filelist = []
-    for f in _extract_files(db, zf, sep, whitelist, progress):
-        filelist.append(f)
+    # extract the file data and store as Data objects in the database while
+    # generating the metadata, which we insert in batches as we go, so that
+    # we do not need to keep the metadata of all entries in memory
+    entries = _extract_files(db, zf, sep, whitelist, progress, buf)
 
     # we have seen zipfiles where intermediate paths have no explicit zip
     # member, we need to generate these ourselves to maintain a proper file
-    # hierarchy
-    missing_dirs = _missing_directories(db, filelist, fileid)
+    # hierarchy, so keep track of the directories while inserting
+    all_dir_paths = set()
+    present_dirs = set()
 
     # before inserting the modelitems, disable duplicate checking, since
     # processed zipfiles are not processed twice, and because we add specific
@@ -333,22 +407,23 @@ def _unzip(db, zf, fileid, sep, whitelist, progress):
     # duplicates, but this should normally not occur.
     db.disable_duplicate_checking(_fmodel.MODELNAME)
 
-    # Iterate over the members and insert the file modelitems
+    # create the file modelitems and insert them into the database
+    make = _modelitem_factory(db, fileid)
     rowids = []
-
-    if progress is True:
-        filelist = _progresswrapper(filelist, '{:20s}'.format('    insert files'))
-
-    # create the file modelitems and insert into the database
     try:
-        for f in filelist:
-            m = _make_modelitem(db, f, fileid)
-            rowid = db.insert_modelitem(m)
-            rowids.append(rowid)
-
-        for m in missing_dirs:
-            rowid = db.insert_modelitem(m)
-            rowids.append(rowid)
+        batch = list(_islice(entries, INSERT_BATCHSIZE))
+        while len(batch) != 0:
+            for f in batch:
+                _collect_directories(f, all_dir_paths, present_dirs)
+            # fetch the previously inserted Data objects all at once
+            data_objs = db.get_data_many([f.data_id for f in batch])
+            items = (make(f, data_objs) for f in batch)
+            rowids.extend(db.insert_modelitems(items))
+            batch = list(_islice(entries, INSERT_BATCHSIZE))
+
+        # and finally the missing directories
+        missing_dirs = _missing_directories(db, all_dir_paths - present_dirs, fileid)
+        rowids.extend(db.insert_modelitems(missing_dirs))
 
     finally:
         # enable duplicate checking again
@@ -357,70 +432,75 @@ def _unzip(db, zf, fileid, sep, whitelist, progress):
     return rowids
 
 
-def _extract_files(db, zf, sep, whitelist, progress):
+def _extract_files(db, zf, sep, whitelist, progress, buf=None):
     ''' extract file data and metadata from given zipfile object
 
     Note: in this function the data for each file is extracted and inserted
     into the database. The id of the corresponding Data object is returned
     as part of the metadata associated with the ZipInfo object.
+
+    If the data of the zipfile is given as buffer (i.e. an mmap or bytes
+    object), the data of the members is decompressed ahead in a pool of
+    threads, while the data is inserted in the original order.
     '''
 
-    # keep track of files to extract in case of a whitelist
-    to_extract = []
+    # keep track of files to extract in case of a whitelist, and of the
+    # directories (with trailing separator) that lead up to these files
+    to_extract = set()
+    to_extract_dirs = set()
+
+    # the list of ZipInfo elements
+    infolist = zf.infolist()
 
     if whitelist != None:
-        # convert whitelist with file globbing chars to regular expressions
-        whitelist = [_fnmatch.translate(p) for p in whitelist]
-        whitelist = [_re.compile(r) for r in whitelist]
+        # convert whitelist with file globbing chars to a regular expression
+        regex = _whitelist_regex(tuple(whitelist))
         # if we have a whitelist, we want to include the metadata for the
         # directories that contain the files of the whitelisted files as well,
         # so iterate over the infolist to collect the files to extract so
         # we can match directories when iterating the second time
-        infolist = zf.infolist()
-        for zinfo in infolist:
-            for regex in whitelist:
-                if regex.match(zinfo.filename):
-                    to_extract.append(zinfo.filename)
-
-    # the list of ZipInfo elements
-    infolist = zf.infolist()
+        match = regex.match
+        to_extract = {zinfo.filename for zinfo in infolist if match(zinfo.filename)}
+        # precompute the directories on the path to each file, so that we
+        # do not need to compare each entry against each file to extract
+        for fname in to_extract:
+            pos = fname.find('/')
+            while pos != -1:
+                to_extract_dirs.add(fname[:pos+1])
+                pos = fname.find('/', pos+1)
 
     if progress is True:
         infolist = _progresswrapper(infolist, '{:20s}'.format('    extracting'))
 
-    for zinfo in infolist:
+    members = _selected_members(infolist, to_extract, to_extract_dirs)
 
-        if zinfo.filename != zinfo.orig_filename:
-            raise ValueError('expected filename and orig_filename to be equal')
+    # only prefetch if we can use more than a single thread
+    threads = min(PREFETCH_THREADS, _os.cpu_count() or 1)
+    if buf is not None and threads > 1:
+        members = _prefetch_members(buf, members, threads)
+    else:
+        members = ((zinfo, None) for zinfo in members)
 
-        # if we have any files to extract (only when using whitelist)
-        # check if the current entry may be the file itself or a directory
-        # leading up to the file, which we also want to extract, mainly to
-        # preserve the metadata associated with the directory
-        if len(to_extract) != 0:
-            match = False
-            for fname in to_extract:
-                match = False
-                if zinfo.filename == fname:
-                    # this is a file that matches the whitelist
-                    match = True
-                    break
-                elif zinfo.is_dir() is True:
-                    if fname.startswith(zinfo.filename):
-                        # this is a directory on the path to a file in whitelist
-                        match = True
-                        break
-            if match == False:
-                # skip this zinfo object
-                continue
+    for zinfo, prefetched in members:
 
         is_dir = zinfo.is_dir()
         data_id = None
         password = False
         if not is_dir:
             try:
-                data = zf.open(zinfo.filename)
-                data_id = db.insert_data(data)
+                if prefetched is not None:
+                    # data was decompressed by one of the prefetch threads
+                    # (re-raises the exception from that thread, if any)
+                    data_id = db.insert_data(_io.BytesIO(prefetched.result()))
+                else:
+                    # NOTE: open by ZipInfo to skip the lookup by name, and
+                    #       close the member afterwards to release its handle.
+                    #       The member is passed as-is: insert_data already
+                    #       reads in MAXBLOCKSIZE chunks, so neither wrapping
+                    #       it in a BufferedReader nor reading small members
+                    #       into bytes first reduces the number of reads
+                    with zf.open(zinfo) as data:
+                        data_id = db.insert_data(data)
             except RuntimeError as e:
                 if "password required" in e.args[0]:
                     password = True
@@ -443,58 +523,205 @@ def _extract_files(db, zf, sep, whitelist, progress):
                 # ignore the extra field if a parsing error ocurred
                 pass
 
+        if extra is not None:
+            mtime, atime, ctime, btime, uid, gid, inode, device = extra
+        else:
+            mtime, atime, ctime, btime, uid, gid, inode, device = (None,) * 8
+
+        # if mtime is not in extra properties, use the basic naive mtime
+        if mtime is None:
+            try:
+                mtime = _datetime(*zinfo.date_time)
+            except ValueError:
+                pass
+
         # yield the metadata for the current zip entry
-        yield (path, zinfo.file_size, zinfo.date_time,
-               zinfo.external_attr, zinfo.internal_attr,
-               extra, is_dir, data_id, password)
+        yield _zipentry(path, zinfo.file_size, mtime, atime, ctime, btime,
+                        uid, gid, inode, device, zinfo.external_attr,
+                        zinfo.internal_attr, is_dir, data_id, password)
 
     return
 
 
-def _make_modelitem(db, values, fileid):
-    ''' convert the tuples yielded by _extract_files to modelitems '''
+def _selected_members(infolist, to_extract, to_extract_dirs):
+    ''' yield the ZipInfo objects that need to be extracted '''
 
-    # determine filename
-    fname = _os.path.basename(values[0])
+    for zinfo in infolist:
 
-    # determine filetype
-    if values[6] is True:
-        ftype = _fmodel.Filetype.directory
-    else:
-        ftype = _fmodel.Filetype.regular_file
+        if zinfo.filename != zinfo.orig_filename:
+            raise ValueError('expected filename and orig_filename to be equal')
 
-    # extract some info from the extra properties
-    if values[5] is not None:
-        mtime, atime, ctime, btime, uid, gid, inode, device = values[5]
-    else:
-        mtime, atime, ctime, btime, uid, gid, inode, device = (None,) * 8
+        # if we have any files to extract (only when using whitelist)
+        # check if the current entry may be the file itself or a directory
+        # leading up to the file, which we also want to extract, mainly to
+        # preserve the metadata associated with the directory
+        if len(to_extract) != 0:
+            if zinfo.filename in to_extract:
+                # this is a file that matches the whitelist
+                pass
+            elif zinfo.is_dir() is True and zinfo.filename in to_extract_dirs:
+                # this is a directory on the path to a file in whitelist
+                pass
+            else:
+                # skip this zinfo object
+                continue
 
-    # if mtime is not in extra properties, use the basic naive mtime
-    if mtime is None:
-        try:
-            mtime = _datetime(*values[2])
-        except ValueError:
-            pass
+        yield zinfo
+
+
+def _prefetch_members(buf, members, threads):
+    ''' yield (zinfo, future) tuples for the given ZipInfo objects, where the
+    future holds the data of the member, or is None if it is not prefetched
+
+    The members are read from the zipfile in the given buffer, via a
+    separate ZipFile object (and read position) in each thread. Since zlib
+    releases the GIL while decompressing, this allows us to decompress
+    multiple members in parallel.
+    '''
+
+    local = _threading.local()
+
+    def read_member(zinfo):
+        zf = getattr(local, 'zf', None)
+        if zf is None:
+            zf = _zipfile.ZipFile(_BufferReader(buf))
+            local.zf = zf
+        with zf.open(zinfo) as data:
+            return data.read()
+
+    # the members that are submitted, but not yet yielded
+    window = _deque()
+
+    with _ThreadPoolExecutor(threads) as executor:
+        for zinfo in members:
+            # directories have no data, and large members are read by the
+            # caller, so that we don't need to keep these in memory
+            if zinfo.is_dir() or zinfo.file_size > PREFETCH_MAXSIZE:
+                window.append((zinfo, None))
+            else:
+                window.append((zinfo, executor.submit(read_member, zinfo)))
+
+            if len(window) > threads * PREFETCH_WINDOW:
+                yield window.popleft()
+
+        while len(window) != 0:
+            yield window.popleft()
+
+
+class _BufferReader(_io.RawIOBase):
+    ''' read-only file object with its own read position on a buffer (i.e.
+    an mmap or bytes object), so that multiple threads can read the same
+    buffer concurrently '''
+
+    def __init__(s, buf):
+        s._buf = buf
+        s._pos = 0
+
+    def readable(s):
+        return True
+
+    def seekable(s):
+        return True
+
+    def tell(s):
+        return s._pos
+
+    def seek(s, offset, whence=_io.SEEK_SET):
+        if whence == _io.SEEK_SET:
+            pos = offset
+        elif whence == _io.SEEK_CUR:
+            pos = s._pos + offset
+        elif whence == _io.SEEK_END:
+            pos = len(s._buf) + offset
+        else:
+            raise ValueError('invalid whence value')
+        if pos < 0:
+            raise ValueError('negative seek position')
+        s._pos = pos
+        return pos
+
+    def read(s, size=-1):
+        # NOTE: slicing does not change the position of an mmap object
+        if size is None or size < 0:
+            end = len(s._buf)
+        else:
+            end = s._pos + size
+        data = s._buf[s._pos:end]
+        s._pos += len(data)
+        return data
+
+    def readinto(s, b):
+        data = s.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+@_lru_cache(maxsize=128)
+def _whitelist_regex(whitelist):
+    ''' return a single compiled regular expression that matches any of the
+    globbing patterns in the given whitelist (tuple) '''
+
+    # NOTE: a single alternation is matched in one call per filename, instead
+    #       of a call per pattern in the whitelist
+    patterns = ['(?:{:s})'.format(_translate(p)) for p in whitelist]
+    return _re.compile('|'.join(patterns))
+
+
+@_lru_cache(maxsize=256)
+def _translate(pattern):
+    ''' returns the regular expression for the given globbing pattern
+
+    NOTE: this caches fnmatch.translate, so that patterns that are shared by
+          different whitelists are translated only once
+    '''
+
+    return _fnmatch.translate(pattern)
+
+
+def _modelitem_factory(db, fileid):
+    ''' returns a function make(entry, data_objs) that converts the zipentry
+    tuples yielded by _extract_files to modelitems, using the dictionary
+    data_objs to look up the Data objects by id '''
+
+    # bind the names and values that are the same for each entry once,
+    # instead of looking them up for each entry
+    make_modelitem = db.make_modelitem
+    modelname = _fmodel.MODELNAME
+    directory = _fmodel.Filetype.directory
+    regular_file = _fmodel.Filetype.regular_file
+    intact = _fmodel.Deleted.intact
+    basename = _os.path.basename
 
     # add a user_tag, to make each file unique when duplicates exist in
     # different zip files
-    if values[8] is True:
-        user_tag = 'could not extract from zipfile {:d}; password required'.format(fileid)
-    else:
-        user_tag = 'extracted from file {:d} by zipmodel'.format(fileid)
+    password_tag = 'could not extract from zipfile {:d}; password required'.format(fileid)
+    extracted_tag = 'extracted from file {:d} by zipmodel'.format(fileid)
+
+    def make(entry, data_objs):
+        # determine filetype
+        if entry.is_dir is True:
+            ftype = directory
+        else:
+            ftype = regular_file
+
+        if entry.password is True:
+            user_tag = password_tag
+        else:
+            user_tag = extracted_tag
 
-    # make sure the data object is the previously inserted dadb.Data object
-    data_obj = db.get_data(values[7])
+        # make sure the data object is the previously inserted dadb.Data object
+        data_obj = data_objs.get(entry.data_id)
 
-    # create the modelitem
-    m = db.make_modelitem(_fmodel.MODELNAME, name=fname, path=values[0],
-                          size=values[1], ftype=ftype, mtime=mtime,
-                          atime=atime, ctime=ctime, btime=btime,
-                          inode=inode, device=device, uid=uid, gid=gid,
-                          deleted=_fmodel.Deleted.intact,
-                          data=data_obj, user_tag=user_tag)
+        # create the modelitem
+        return make_modelitem(modelname, name=basename(entry.path),
+                              path=entry.path, size=entry.size, ftype=ftype,
+                              mtime=entry.mtime, atime=entry.atime,
+                              ctime=entry.ctime, btime=entry.btime,
+                              inode=entry.inode, device=entry.device,
+                              uid=entry.uid, gid=entry.gid, deleted=intact,
+                              data=data_obj, user_tag=user_tag)
 
-    return m
+    return make
 
 
 def _parse_extra(data):
@@ -506,13 +733,17 @@ def _parse_extra(data):
     swap_timestamps = False
     extra_time = None
 
+    # local aliases, since these are used for each timestamp
+    fromtimestamp = _datetime.fromtimestamp
+    u32 = _U32.unpack_from
+
     # scan over the data in order to find extra field magics
     pos = 0
     maxpos = len(data)-4
 
     while pos < maxpos:
-        # parse the header
-        magic, size = _unpack('<HH', data[pos:pos+4])
+        # parse the header (without slicing the data)
+        magic, size = _HEADER.unpack_from(data, pos)
         # carve out the remaining data for the extra block
         field = data[pos+4:pos+4+size]
         # and update our read position
@@ -530,46 +761,44 @@ def _parse_extra(data):
             #       zip files where more than 1 flag was set, but
             #       only a single timestamp was stored
             if flags&1 and offset+4 <= size:
-                mtime = _unpack('<I', field[offset:offset+4])[0]
-                mtime = _datetime.fromtimestamp(mtime, _utc)
+                mtime = fromtimestamp(u32(field, offset)[0], _utc)
                 offset += 4
             if flags&2 and offset+4 <= size:
-                atime = _unpack('<I', field[offset:offset+4])[0]
-                atime = _datetime.fromtimestamp(atime, _utc)
+                atime = fromtimestamp(u32(field, offset)[0], _utc)
                 offset += 4
             if flags&4 and offset+4 <= size:
-                btime = _unpack('<I', field[offset:offset+4])[0]
-                btime = _datetime.fromtimestamp(btime, _utc)
+                btime = fromtimestamp(u32(field, offset)[0], _utc)
                 offset += 4
             if flags&8 and offset+4 <= size:
                 # assume that extra_time is the metadata change time (ctime)
-                ctime = _unpack('<I', field[offset:offset+4])[0]
-                ctime = _datetime.fromtimestamp(ctime, _utc)
+                ctime = fromtimestamp(u32(field, offset)[0], _utc)
                 offset += 4
 
+        # NOTE: use unpack (instead of unpack_from) when the entire field
+        #       is parsed, since this also checks the size of the field
         elif magic == 0x4e49:   # IN
-            inode, device = _unpack("<QI",field)
+            inode, device = _INODE.unpack(field)
 
         elif magic == 0x5855:  # UX
             if size == 8:
-                atime, mtime = _unpack("<LL", field)
-                atime = _datetime.fromtimestamp(atime, _utc)
-                mtime = _datetime.fromtimestamp(mtime, _utc)
+                atime, mtime = _UX8.unpack(field)
+                atime = fromtimestamp(atime, _utc)
+                mtime = fromtimestamp(mtime, _utc)
             elif size == 12:
-                atime, mtime, uid, gid = _unpack("<LLHH", field)
-                atime = _datetime.fromtimestamp(atime, _utc)
-                mtime = _datetime.fromtimestamp(mtime, _utc)
+                atime, mtime, uid, gid = _UX12.unpack(field)
+                atime = fromtimestamp(atime, _utc)
+                mtime = fromtimestamp(mtime, _utc)
             else:
                 # this should not happen, ignore entry
                 pass
 
         elif magic == 0x7875:  # ux
-            version, uidsize = _unpack("<BB", field[0:2])
+            version, uidsize = _UXVERSION.unpack_from(field, 0)
             # for now ignore other uid/gid sizes
             if uidsize == 4:
-                uid, gidsize = _unpack("<IB", field[2:7])
+                uid, gidsize = _UXUID.unpack_from(field, 2)
                 if uidsize == 4:
-                    gid = _unpack("<I", field[7:11])[0]
+                    gid = u32(field, 7)[0]
 
         elif magic == 0x4b47:
             # observed in some zip files, not 100% sure
@@ -605,26 +834,30 @@ def _path_with_parents(path):
     return
 
 
-def _missing_directories(db, filelist, fileid):
-    ''' return list of missing directories in the zip hierarchy '''
+def _collect_directories(entry, all_dir_paths, present_dirs):
+    ''' add the directory paths for the given zipentry to the given sets '''
 
     # intermediate directories do not always have a separate entry in
     # the zip file, so in order to create a valid file hierarchy we may
     # need to create intermediate directories ourselves. For this we
     # need to collect all sub-paths that are part of the stored zip entries
-    all_dir_paths = set()
-    present_dirs = set()
-    for f in filelist:
-        if f[6] is True:
-            # this is a directory
-            all_dir_paths.add(f[0])
-            present_dirs.add(f[0])
-        # add all path parents
-        for p in _path_with_parents(f[0]):
-            all_dir_paths.add(p)
-
-    # return a set with the missing directory paths
-    missing_dirs = all_dir_paths - present_dirs
+    if entry.is_dir is True:
+        # this is a directory
+        all_dir_paths.add(entry.path)
+        present_dirs.add(entry.path)
+    # add all path parents
+    # NOTE: the parents of a path in all_dir_paths are always added as
+    #       well, so we can stop at the first parent we have already seen
+    #       instead of walking up the same parents for each sibling
+    for p in _path_with_parents(entry.path):
+        if p in all_dir_paths:
+            break
+        all_dir_paths.add(p)
+
+
+def _missing_directories(db, missing_dirs, fileid):
+    ''' generate modelitems for the given missing directories in the zip
+    hierarchy (as determined via _collect_directories) '''
 
     if len(missing_dirs) == 0:
         return
@@ -652,9 +885,10 @@ def _entry_by_fileid(db, fileid):
         mtbl = db.get_tblname(MODELNAME)
         mfid = db.get_colname(MODELNAME, 'file')
         mkey = db.get_colname(MODELNAME)
-        _BY_FILEID_QUERY='SELECT {:s} FROM {:s} WHERE {:s} == ?'.format(mkey, mtbl, mfid)
+        # NOTE: two results are sufficient to detect a corrupt database
+        _BY_FILEID_QUERY='SELECT {:s} FROM {:s} WHERE {:s} == ? LIMIT 2'.format(mkey, mtbl, mfid)
 
-    results = list(db.dbcon.cursor().execute(_BY_FILEID_QUERY, (fileid,)))
+    results = db.dbcon.cursor().execute(_BY_FILEID_QUERY, (fileid,)).fetchall()
     if len(results) == 0:
         return None
     elif len(results) == 1:
@@ -687,32 +921,46 @@ def _extracted_files(db):
 def _unprocessed_file_ids(db):
     ''' generates file_ids that have not yet been processed as zipfile '''
 
-    # prepare query for files with proper mimetype or substring in magic
-    libmagictable = db.get_tblname(_libmagicmodel.MODELNAME)
-    mimetype = db.get_colname(_libmagicmodel.MODELNAME, 'mimetype')
-    libmagic = db.get_colname(_libmagicmodel.MODELNAME, 'libmagic')
-    fileid = db.get_colname(_libmagicmodel.MODELNAME, 'file')
-    mimes = ['{:s}.{:s} == "{:s}"'.format(libmagictable, mimetype, t) for t in ZIP_MIMES]
-    where = ' OR '.join(mimes)
-    candidates = 'SELECT {:s}.{:s} FROM {:s} WHERE ({:s})'.format(libmagictable, fileid, libmagictable, where)
-
-    # and we need only those files that are not already extracted
-    my_table = db.get_tblname(MODELNAME)
-    my_fileid = db.get_colname(MODELNAME, 'file')
-    processed_files = 'SELECT {:s}.{:s} FROM {:s}'.format(my_table, my_fileid, my_table)
-
-    # exclude files that already have children (i.e. already decompressed?)
-    parenttbl = db.get_tblname(_fparentmodel.MODELNAME)
-    parentid = db.get_colname(_fparentmodel.MODELNAME, 'parent')
-    parents = 'SELECT {:s}.{:s} FROM {:s}'.format(parenttbl, parentid, parenttbl)
-
-    # select those files that are not processed and are not parents
-    q = '''{:s} AND ({:s}.{:s} NOT IN ({:s})) AND ({:s}.{:s} NOT IN ({:s}))'''
-    q = q.format(candidates, libmagictable, fileid, processed_files, libmagictable, fileid, parents)
+    # prevent building the query every function call (i.e. every round)
+    global _UNPROCESSED_QUERY
+
+    if _UNPROCESSED_QUERY is None:
+        # prepare query for files with proper mimetype or substring in magic
+        libmagictable = db.get_tblname(_libmagicmodel.MODELNAME)
+        mimetype = db.get_colname(_libmagicmodel.MODELNAME, 'mimetype')
+        libmagic = db.get_colname(_libmagicmodel.MODELNAME, 'libmagic')
+        fileid = db.get_colname(_libmagicmodel.MODELNAME, 'file')
+        mimes = tuple(sorted(ZIP_MIMES))
+        where = '{:s}.{:s} IN ({:s})'.format(libmagictable, mimetype, ','.join('?'*len(mimes)))
+
+        # and we need only those files that are not already extracted
+        my_table = db.get_tblname(MODELNAME)
+        my_fileid = db.get_colname(MODELNAME, 'file')
+
+        # exclude files that already have children (i.e. already decompressed?)
+        parenttbl = db.get_tblname(_fparentmodel.MODELNAME)
+        parentid = db.get_colname(_fparentmodel.MODELNAME, 'parent')
+
+        # select those files that are not processed and are not parents, using
+        # anti-joins (which can use the indexes created in register_with_db)
+        candidate = '{:s}.{:s}'.format(libmagictable, fileid)
+        processed = '{:s}.{:s}'.format(my_table, my_fileid)
+        parent = '{:s}.{:s}'.format(parenttbl, parentid)
+        q = '''SELECT {:s} FROM {:s}
+               LEFT JOIN {:s} ON {:s} == {:s}
+               LEFT JOIN {:s} ON {:s} == {:s}
+               WHERE ({:s}) AND {:s} IS NULL AND {:s} IS NULL'''
+        q = q.format(candidate, libmagictable, my_table, processed, candidate,
+                     parenttbl, parent, candidate, where, processed, parent)
+
+        # store the query together with its parameters
+        _UNPROCESSED_QUERY = (q, mimes)
+
+    q, mimes = _UNPROCESSED_QUERY
 
     # fetch all results and store in a list of file ids and use dedicated
     # cursor to prevent issues with aborted SELECT statements
-    results = [r[0] for r in db.dbcon.cursor().execute(q)]
+    results = [r[0] for r in db.dbcon.cursor().execute(q, mimes)]
     return results
 
 
@@ -5,9 +5,9 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
 import tempfile
+import hashlib
 import os
 import random
-import subprocess
 
 from .._database import Database
 
@@ -61,23 +61,16 @@ def generate_random_file():
     count =     int(random.random() * 60)
     if count == 0: count = 1
     if blocksize == 0: blocksize = 1024 * 1024
-    proc = subprocess.Popen(['dd','if=/dev/urandom','of='+tmp.name,
-                     'bs='+ str(blocksize),'count='+ str(count)],
-                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout = [l.decode().rstrip() for l in proc.stdout]
-    stderr = [l.decode().rstrip() for l in proc.stderr]
-    if stdout != []:
-        raise ValueError("dd produced output on stdout: {:}".format(' '.join(stdout)))
-
-    proc = subprocess.Popen(['sha256sum',tmp.name],
-                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout = [l.decode().rstrip() for l in proc.stdout]
-    stderr = [l.decode().rstrip() for l in proc.stderr]
-    if stderr != []:
-        raise ValueError("sha256sum produced output on stderr: {:}".format(' '.join(stderr)))
-
-    sha256, path = stdout[0].split()
-    return sha256, path
+    # and calculate the sha256 while writing, so we don't need to read the
+    # file back afterwards
+    hasher = hashlib.sha256()
+    with open(tmp.name, 'wb') as f:
+        for i in range(count):
+            block = os.urandom(blocksize)
+            hasher.update(block)
+            f.write(block)
+
+    return hasher.hexdigest(), tmp.name
 
 
 def generate_random_files():
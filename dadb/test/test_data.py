@@ -4,65 +4,117 @@ Copyright (c) 2023-2025 Netherlands Forensic Institute - MIT License
 Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
-import subprocess
+import os
 from . import helpers
 
 
 def insert_data(database, tempfiles):
-    ''' insert the data objects from the tempfiles into the database '''
+    ''' insert the data objects from the tempfiles into the database and check
+    the stored sha256 of each data object '''
 
     # keep track of the mapping of object_ids of the Data objects to the
-    # filenames of the originating files
+    # filenames of the originating files (and their size at insert time)
     data_objects = {}
 
-    for sha256, name in tempfiles.items():
-        with open(name, 'rb') as f:
-            oid = database.insert_data(f)
-            data_objects[oid] = (sha256, name)
+    # insert all files in a single transaction, to commit only once
+    started_transaction = database.begin_transaction()
+
+    try:
+        for sha256, name in tempfiles.items():
+            # NOTE: insert_data reads in blocks of MAXBLOCKSIZE, which is
+            #       larger than any sensible read buffer, so read from the
+            #       raw file
+            with open(name, 'rb', buffering=0) as f:
+                oid = database.insert_data(f)
+                size = os.fstat(f.fileno()).st_size
+                data_objects[oid] = (sha256, name, size)
+    except:
+        if started_transaction is True:
+            database.rollback_transaction()
+        raise
+
+    if started_transaction is True:
+        database.end_transaction()
+
+    # check if the stored sha256 matches the original sha256, fetching the
+    # metadata of all inserted data objects at once
+    for id_, data_object in database.get_data_many(data_objects).items():
+        sha256, path, size = data_objects[id_]
+        if data_object.sha256 != sha256:
+            raise ValueError("sha256 mismatch for {:}".format(path))
 
     return data_objects
 
 
-def check_stored_hashes(database, objects):
-    ''' for each file check if the stored sha256 matches the original sha256
-    '''
+def _cmp_streams(a, b, bufsize=1<<20):
+    ''' compare two binary streams chunk by chunk, returns the offset of the
+    first differing chunk, or None if the streams are equal '''
 
-    for id_, (sha256, path) in objects.items():
-        data_object = database.get_data(id_)
-        if data_object.sha256 != sha256:
-            raise ValueError("sha256 mismatch for {:}".format(path))
+    offset = 0
+    while True:
+        chunk_a = a.read(bufsize)
+        chunk_b = b.read(bufsize)
+        if chunk_a != chunk_b:
+            return offset
+        if not chunk_a:
+            return None
+        offset += len(chunk_a)
+
+
+def _fadvise(f, advice):
+    ''' give the named advice for the entire file f, if supported by the OS '''
+
+    if hasattr(os, 'posix_fadvise') and hasattr(os, advice):
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
 
 
 def check_reading(database, objects):
     ''' check data by reading the data back from the database and writing to
     file system and comparing with input data '''
 
-    for id_, (sha256, path) in objects.items():
-        data_object = database.get_data(id_)
+    # fetch all data objects at once
+    data_objects = database.get_data_many(objects)
+
+    # stream the data objects to file via a single reusable buffer
+    buf = bytearray(1<<20)
+    view = memoryview(buf)
+
+    for id_, (sha256, path, size) in objects.items():
+        data_object = data_objects[id_]
         outname = path + ".out"
-        open(outname, 'wb').write(data_object.read())
-        proc = subprocess.Popen(['cmp',path, outname],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout = [l.decode().rstrip() for l in proc.stdout]
-        stderr = [l.decode().rstrip() for l in proc.stderr]
-        if stdout != []:
-            raise ValueError(' '.join(stdout))
+        # NOTE: readinto fills the entire given buffer, so the last part of
+        #       the data is read into a view of the remaining size
+        remaining = data_object.length
+        with open(outname, 'wb') as out:
+            while remaining > 0:
+                n = min(remaining, len(buf))
+                data_object.readinto(view[:n])
+                out.write(view[:n])
+                remaining -= n
+        with open(path, 'rb') as fa, open(outname, 'rb') as fb:
+            _fadvise(fa, 'POSIX_FADV_SEQUENTIAL')
+            _fadvise(fb, 'POSIX_FADV_SEQUENTIAL')
+            offset = _cmp_streams(fa, fb)
+            # both files are discarded after the comparison, so there is no
+            # need to keep them in the page cache
+            _fadvise(fa, 'POSIX_FADV_DONTNEED')
+            _fadvise(fb, 'POSIX_FADV_DONTNEED')
+        if offset is not None:
+            raise ValueError("{:} {:} differ in chunk at offset {:}".format(
+                             path, outname, offset))
 
 
 def check_size(database, objects):
-    ''' check data by reading the data back from the database and writing to
-    filesystem and comparing with input data '''
+    ''' check the length of the data objects against the size of the input
+    files, as recorded when they were inserted '''
+
+    # fetch all data objects at once
+    data_objects = database.get_data_many(objects)
 
-    for id_, (sha256, path) in objects.items():
-        data_object = database.get_data(id_)
+    for id_, (sha256, path, size) in objects.items():
+        data_object = data_objects[id_]
         # call the check_length function
         data_object._check_length()
-        proc = subprocess.Popen(['stat','-c', '%s', path],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout = [l.decode().rstrip() for l in proc.stdout]
-        if len(stdout) != 1:
-            raise ValueError("something wrong in stat output")
-        size = int(stdout[0])
         if size != data_object.length:
             raise ValueError("incorrect size for data object in database")
 
@@ -82,12 +134,10 @@ def test_data_object():
     # generate a test database
     database = helpers.generate_testdb()
 
-    # insert the data into the test database
+    # insert the data into the test database, this also checks the stored
+    # hashes for the inserted binary data
     objects = insert_data(database, tempfiles)
 
-    # check the stored hashes for the inserted binary data
-    check_stored_hashes(database, objects)
-
     # check reading back the data objects
     check_reading(database, objects)
 
@@ -5,12 +5,16 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
 from io import BytesIO as _BytesIO
+from datetime import datetime as _datetime
+
+import apsw as _apsw
 
 from . import helpers as _helpers
 from .._model_definition import field_definition as _field_def
 from .._model_definition import model_definition as _model_def
 from .._database import Database as _Database
 from .._exceptions import NoSuchDataObjectError as _NoSuchDataObjectError
+from .._exceptions import ReadOnlyModelError as _ReadOnlyModelError
 
 
 def test_datatabase_object():
@@ -22,6 +26,22 @@ def test_datatabase_object():
     # generate a test database
     database = _helpers.generate_testdb()
 
+    _basic_properties(database)
+    _transactions(database)
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_reopen_database():
+    ''' test the Database object after closing and reopening the database '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # generate a test database
+    database = _helpers.generate_testdb()
+
     name = database.dbname
 
     database.close()
@@ -30,7 +50,175 @@ def test_datatabase_object():
     database.reload()
 
     _basic_properties(database)
-    _transactions(database)
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_wide_model():
+    ''' test the timeline preview of a model with many preview fields '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # generate a test database
+    database = _helpers.generate_testdb()
+
+    # a model with more preview fields than fit in a single printf call
+    nfields = 200
+    fields = [_field_def('timestamp', _datetime)]
+    fields += [_field_def('f{:d}'.format(i), str, preview=True) for i in range(nfields)]
+    database.register_model(_model_def('wide', fields, 'test', 1))
+
+    values = {'f{:d}'.format(i):'v{:d}'.format(i) for i in range(nfields)}
+    tstamp = _datetime(2022, 1, 16, 1, 23, 45)
+    item = database.make_modelitem('wide', timestamp=tstamp, **values)
+    database.insert_modelitem(item)
+
+    timeline = list(database.timeline())
+    if len(timeline) != 1:
+        raise ValueError('expected a single timeline entry')
+
+    expected = '|'.join('{:s}:{:s}'.format(k, v) for k, v in values.items())
+    if timeline[0][4] != expected:
+        raise ValueError('unexpected timeline preview for wide model')
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def _register_item_model(database):
+    ''' registers a simple model for the modelitem tests '''
+
+    fields = [_field_def('name', str, nullable=False),
+              _field_def('value', int)]
+    database.register_model(_model_def('item', fields, 'test', 1))
+
+
+def test_insert_modelitems():
+    ''' test inserting a sequence of modelitems at once '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # generate a test database
+    database = _helpers.generate_testdb()
+    _register_item_model(database)
+
+    items = [database.make_modelitem('item', name='n{:d}'.format(i), value=i)
+             for i in range(10)]
+    rowids = database.insert_modelitems(items)
+    if len(rowids) != len(items):
+        raise ValueError('expected a rowid for each inserted modelitem')
+
+    # read back the inserted modelitems
+    for i, rowid in enumerate(rowids):
+        item = database.modelitem('item', rowid)
+        if item.name != 'n{:d}'.format(i) or item.value != i:
+            raise ValueError('error in reading back inserted modelitem')
+
+    # integers are passed as rowids of existing modelitems
+    if database.insert_modelitems([rowids[0]]) != [rowids[0]]:
+        raise ValueError('expected rowid to be returned as is')
+
+    # when one of the modelitems can not be inserted, none are inserted
+    items = [database.make_modelitem('item', name='x', value=1), 'no modelitem']
+    try:
+        database.insert_modelitems(items)
+        raise ValueError('expected insert of invalid modelitem to fail')
+    except _ReadOnlyModelError:
+        pass
+
+    if database.total_modelitems('item') != len(rowids):
+        raise ValueError('expected modelitems of failed insert to be rolled back')
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_readonly_database():
+    ''' test loading a database read-only '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # generate a test database with a single modelitem
+    database = _helpers.generate_testdb()
+    _register_item_model(database)
+    item = database.make_modelitem('item', name='n', value=1)
+    rowid = database.insert_modelitem(item)
+    name = database.dbname
+    database.close()
+
+    database = _Database(name, readonly=True)
+
+    try:
+        database.create()
+        raise ValueError('expected create to fail on read-only database')
+    except RuntimeError:
+        pass
+
+    database.load()
+
+    # reading is allowed
+    item = database.modelitem('item', rowid)
+    if item.name != 'n' or item.value != 1:
+        raise ValueError('error in reading modelitem from read-only database')
+
+    # writing is not, also not when bypassing the Database API
+    try:
+        database.dbcur.execute('DELETE FROM xdata')
+        raise ValueError('expected write to read-only database to fail')
+    except (_apsw.ReadOnlyError, _apsw.SQLError):
+        pass
+
+    database.close()
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_upgrade_schema_3():
+    ''' test loading a database with schema version 3 '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    database = _helpers.generate_testdb()
+    _register_item_model(database)
+    fieldinfo = sorted(database.dbcur.execute('SELECT * FROM _fieldinfo_'))
+    name = database.dbname
+
+    # schema 3 has a _fieldinfo_ view instead of a table
+    database.dbcur.execute('CREATE TABLE _fieldinfo3_ AS SELECT * FROM _fieldinfo_;'
+                           'DROP TABLE _fieldinfo_;'
+                           'CREATE VIEW _fieldinfo_ AS SELECT * FROM _fieldinfo3_;'
+                           'UPDATE _reserved_ SET schemaversion = 3')
+    database.close()
+
+    # read-only databases are loaded as is
+    database = _Database(name, readonly=True)
+    database.load()
+    if list(database.dbcur.execute('SELECT schemaversion FROM _reserved_')) != [(3,)]:
+        raise ValueError('expected read-only database not to be upgraded')
+    database.close()
+
+    # other databases are upgraded while loading
+    database = _Database(name)
+    database.load()
+    q = "SELECT type FROM sqlite_master WHERE name == '_fieldinfo_'"
+    if list(database.dbcur.execute(q)) != [('table',)]:
+        raise ValueError('expected _fieldinfo_ view to be replaced by a table')
+    if list(database.dbcur.execute('SELECT schemaversion FROM _reserved_')) != [(4,)]:
+        raise ValueError('expected schema version to be upgraded')
+    if sorted(database.dbcur.execute('SELECT * FROM _fieldinfo_')) != fieldinfo:
+        raise ValueError('unexpected _fieldinfo_ after upgrade')
+    database.close()
+
+    # and can be loaded again as usual
+    database = _Database(name)
+    database.load()
+    database.close()
 
     # cleanup generated files
     _helpers.clean_generated()
@@ -103,6 +291,21 @@ def _transactions(database):
     # now attempt to rollback again
     rolled_back = database.rollback_transaction()
 
+    if rolled_back is True:
+        raise ValueError('expected rollback to fail')
+
+    # rolling back a transaction in which nothing was done should succeed
+    started_transaction = database.begin_transaction()
+    if started_transaction is False:
+        raise ValueError('expected started_transaction is True')
+
+    rolled_back = database.rollback_transaction()
+
+    if rolled_back is False:
+        raise ValueError('expected rollback of empty transaction to succeed')
+
+    rolled_back = database.rollback_transaction()
+
     if rolled_back is True:
         raise ValueError('expected rollback to fail')
 
@@ -123,7 +326,9 @@ def _transactions(database):
     # commit
     database.end_transaction()
 
-    # and read it back
-    read_bytes = database.get_data(dataid).read()
-    if read_bytes != bytes_:
+    # and read it back into a preallocated buffer, comparing it via a
+    # memoryview (prevents the extra copy made by read)
+    buf = bytearray(len(bytes_))
+    database.get_data(dataid).readinto(buf)
+    if memoryview(buf) != bytes_:
         raise ValueError('error in reading back bytes')
@@ -5,14 +5,13 @@ Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
 '''
 
 import datetime
-import pytz
 from .. import _datatype as dtype
 
 def test_converters():
     ''' test convert functions '''
 
     a = dtype.from_iso8601('20220116T012345+00:00')
-    b = datetime.datetime(2022, 1, 16, 1, 23, 45).replace(tzinfo=pytz.UTC)
+    b = datetime.datetime(2022, 1, 16, 1, 23, 45, tzinfo=datetime.timezone.utc)
     assert a == b, 'from_iso_8601 failed!'
 
     a = datetime.datetime(2016, 4, 16, 14, 23, 45)
@@ -0,0 +1,245 @@
+''' test_stringsmodel.py - tests for the strings model in DADB
+
+Copyright (c) 2023-2025 Netherlands Forensic Institute - MIT License
+Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
+'''
+
+import os as _os
+import tempfile as _tempfile
+
+import apsw as _apsw
+
+from . import helpers as _helpers
+from ..models import filemodel as _filemodel
+from ..models import stringsmodel as _stringsmodel
+
+
+# test data with 7-bit, 8-bit and 16-bit little endian strings, and runs of
+# printable characters that are too short to be reported
+TESTDATA = (b'\x00\x01hello world\x00ab\x00\tTab\there\xff\xfe' +
+            'Déjà vu, naïve café'.encode('latin_1') + b'\x00' +
+            'wide string'.encode('utf-16-le') + b'\x00\x00xyz\x00' +
+            b'\x07Torvalds\x00\x00last')
+
+# the output of 'strings -a -e <encoding>' on the TESTDATA, by StringType name
+EXPECTED_STRINGS = {
+    _stringsmodel.StringType.Sevenbit.name:
+        'hello world\n\tTab\there\n vu, na\nve caf\nTorvalds\nlast\n',
+    _stringsmodel.StringType.Eightbit.name:
+        'hello world\n\tTab\there\xff\xfeD\xe9j\xe0 vu, na\xefve caf\xe9\n'
+        'Torvalds\nlast\n',
+    _stringsmodel.StringType.LittleEndian16bit.name:
+        'wide string\n'}
+
+
+def _testdb_with_file(data):
+    ''' returns a test database with the strings model registered and the
+    fileid of a file with the given data '''
+
+    database = _helpers.generate_testdb()
+    _stringsmodel.register_with_db(database)
+
+    # the generated file is removed by clean_generated
+    tmp = _tempfile.NamedTemporaryFile(dir=_helpers.GENDIR, delete=False)
+    tmp.write(data)
+    tmp.close()
+
+    fileid = _filemodel.insert(database, tmp.name)
+    return database, fileid
+
+
+def test_strings_output():
+    ''' test the strings collected from file data '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    database, fileid = _testdb_with_file(TESTDATA)
+    _stringsmodel.insert(database, fileid)
+
+    records = list(_stringsmodel.items(database))
+    if len(records) != len(EXPECTED_STRINGS):
+        raise ValueError('expected a strings record for each encoding')
+
+    for r in records:
+        if database.modelitem_id(r.file) != fileid or r.offset != 0 or r.error is not None:
+            raise ValueError('unexpected strings record')
+        if r.strings != EXPECTED_STRINGS[r.encoding.name]:
+            raise ValueError('unexpected strings output for {:}'.format(r.encoding))
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_search():
+    ''' test searching with and without FTS, for short and long terms '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    database, fileid = _testdb_with_file(TESTDATA)
+
+    # update uses its own connection settings for the bulk inserts, but
+    # should not leave these behind on our connection
+    pragmas = ('synchronous', 'temp_store', 'cache_size')
+    query = 'PRAGMA {:s}'
+    before = [database.dbcur.execute(query.format(p)).fetchone() for p in pragmas]
+    _stringsmodel.update(database)
+    after = [database.dbcur.execute(query.format(p)).fetchone() for p in pragmas]
+    if before != after:
+        raise ValueError('connection settings not restored after update')
+
+    # the expected hits as (term, offset, bytes) tuples
+    expected = {'Torvalds': [(fileid, TESTDATA.find(b'Torvalds'), b'Torvalds')],
+                # in the middle of a string
+                'orvald': [(fileid, TESTDATA.find(b'orvald'), b'orvald')],
+                # shorter than a trigram
+                'vu': [(fileid, TESTDATA.find(b'vu'), b'vu')],
+                # 16 bit little endian
+                'wide': [(fileid, TESTDATA.find(b'w\x00i'), 'wide'.encode('utf-16-le'))],
+                # wildcard with a short and a long term
+                'lo*ld': [(fileid, TESTDATA.find(b'lo w'), b'lo world')],
+                'nomatch': []}
+
+    for use_fts in (False, True):
+        if use_fts is True:
+            _stringsmodel.enable_fts(database)
+        for term, hits in expected.items():
+            res = [(r.fileid, r.offset, r.bytes) for r in
+                   _stringsmodel.search(database, term, use_fts=use_fts)]
+            if res != hits:
+                raise ValueError('unexpected hits for {:s} (use_fts={:}): {:}'.format(
+                                 term, use_fts, res))
+            files = list(_stringsmodel.search(database, term, use_fts=use_fts,
+                                              files_only=True))
+            if files != [h[0] for h in hits]:
+                raise ValueError('unexpected files for {:s} (use_fts={:})'.format(
+                                 term, use_fts))
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_search_multiproc():
+    ''' test scanning the blocks of a large file with worker processes '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # use a small blocksize, so that the file consists of multiple blocks
+    orig_blocksize = _stringsmodel.BLOCKSIZE
+    _stringsmodel.BLOCKSIZE = 64*1024
+    try:
+        # place hits in different blocks, and one on a block boundary
+        data = bytearray(b'\x00' * (5 * _stringsmodel.BLOCKSIZE))
+        offsets = [100, _stringsmodel.BLOCKSIZE - 4, 3 * _stringsmodel.BLOCKSIZE + 7]
+        for offset in offsets:
+            data[offset:offset+8] = b'Torvalds'
+        database, fileid = _testdb_with_file(bytes(data))
+        _stringsmodel.update(database)
+
+        expected = [(fileid, offset, b'Torvalds') for offset in offsets]
+        for processes in (None, 2):
+            res = [(r.fileid, r.offset, r.bytes) for r in
+                   _stringsmodel.search(database, 'torvalds', processes=processes)]
+            if sorted(res) != expected:
+                raise ValueError('unexpected hits (processes={:}): {:}'.format(
+                                 processes, res))
+            files = list(_stringsmodel.search(database, 'torvalds', files_only=True,
+                                              processes=processes))
+            if files != [fileid]:
+                raise ValueError('unexpected files (processes={:})'.format(processes))
+    finally:
+        _stringsmodel.BLOCKSIZE = orig_blocksize
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_iter_blocks():
+    ''' test the overlapping blocks of a file larger than BLOCKSIZE '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    orig_blocksize = _stringsmodel.BLOCKSIZE
+    _stringsmodel.BLOCKSIZE = 4096
+    try:
+        data = bytes(range(256)) * 50
+        database, fileid = _testdb_with_file(data)
+        f = _filemodel.get(database, fileid)
+        for overlap in (0, 1, 100):
+            for offset, block in _stringsmodel._iter_blocks(f, overlap):
+                if bytes(block) != data[offset:offset+len(block)]:
+                    raise ValueError('unexpected block at offset {:d}'.format(offset))
+            if offset + len(block) != len(data):
+                raise ValueError('blocks do not cover the file (overlap={:d})'.format(overlap))
+
+        # a hit span below 1 is rejected
+        rejected = False
+        try:
+            list(_stringsmodel.search(database, 'Torvalds', max_span=0))
+        except ValueError:
+            rejected = True
+        if rejected is False:
+            raise ValueError('expected search with max_span=0 to fail')
+    finally:
+        _stringsmodel.BLOCKSIZE = orig_blocksize
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def _shared_memory_blocks():
+    ''' returns the names of the shared memory blocks created by Python '''
+
+    if not _os.path.isdir('/dev/shm'):
+        return set()
+    return set([n for n in _os.listdir('/dev/shm') if n.startswith('psm_')])
+
+
+def test_update_shared_memory():
+    ''' test passing strings output from the workers via shared memory '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    # pass all strings output via shared memory
+    orig_threshold = _stringsmodel.SHM_THRESHOLD
+    orig_batchsize = _stringsmodel.INSERT_BATCHSIZE
+    orig_query = _stringsmodel._insert_records_query
+    _stringsmodel.SHM_THRESHOLD = 1
+    blocks = _shared_memory_blocks()
+    try:
+        database, fileid = _testdb_with_file(TESTDATA)
+        _stringsmodel.update(database)
+        for r in _stringsmodel.items(database):
+            if r.strings != EXPECTED_STRINGS[r.encoding.name]:
+                raise ValueError('unexpected strings output for {:}'.format(r.encoding))
+
+        # insert each result directly, and let the first insert fail, so that
+        # the remaining results are still in the queue or being processed
+        for i in range(5):
+            tmp = _tempfile.NamedTemporaryFile(dir=_helpers.GENDIR, delete=False)
+            tmp.write(TESTDATA + bytes([i]))
+            tmp.close()
+            _filemodel.insert(database, tmp.name)
+        _stringsmodel.INSERT_BATCHSIZE = 1
+        _stringsmodel._insert_records_query = lambda db: 'INSERT INTO nosuchtable VALUES (?)'
+        failed = False
+        try:
+            _stringsmodel.update(database)
+        except _apsw.SQLError:
+            failed = True
+        if failed is False:
+            raise ValueError('expected update to fail')
+    finally:
+        _stringsmodel.SHM_THRESHOLD = orig_threshold
+        _stringsmodel.INSERT_BATCHSIZE = orig_batchsize
+        _stringsmodel._insert_records_query = orig_query
+
+    if _shared_memory_blocks() != blocks:
+        raise ValueError('shared memory blocks are not released')
+
+    # cleanup generated files
+    _helpers.clean_generated()
@@ -0,0 +1,129 @@
+''' test_zipmodel.py - tests for the zip model in DADB
+
+Copyright (c) 2023-2025 Netherlands Forensic Institute - MIT License
+Copyright (c) 2024-2025 mxkrt@lsjam.nl - MIT License
+'''
+
+import tempfile as _tempfile
+import zipfile as _zipfile
+
+from . import helpers as _helpers
+from ..models import filemodel as _filemodel
+from ..models import zipmodel as _zipmodel
+
+
+def _contents(i):
+    ''' returns the contents of the i-th member of the test zipfiles '''
+
+    return b'content-%d-' % i * 100
+
+
+def _testzip(count, corrupt=None):
+    ''' generate a zipfile in GENDIR with count members and return its name,
+    when corrupt is given, the data of that member is damaged '''
+
+    # the generated file is removed by clean_generated
+    tmp = _tempfile.NamedTemporaryFile(dir=_helpers.GENDIR, delete=False)
+    with _zipfile.ZipFile(tmp, 'w') as z:
+        for i in range(count):
+            z.writestr('d/f{:d}'.format(i), _contents(i))
+    tmp.close()
+
+    if corrupt is not None:
+        with open(tmp.name, 'rb') as f:
+            data = bytearray(f.read())
+        # flip a byte in the (stored) member data so that the CRC check fails
+        data[data.find(_contents(corrupt))] ^= 0xff
+        with open(tmp.name, 'wb') as f:
+            f.write(data)
+
+    return tmp.name
+
+
+def _data_count(database):
+    ''' returns the number of Data objects and blocks in the database '''
+
+    counts = []
+    for table in ('data', 'block'):
+        q = 'SELECT COUNT(*) FROM {:s}{:s}'.format(database.prefix, table)
+        counts.append(database.dbcur.execute(q).fetchone()[0])
+    return tuple(counts)
+
+
+def test_extract_batched():
+    ''' test extracting a zipfile with more members than fit in one batch '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    database = _helpers.generate_testdb()
+    _zipmodel.register_with_db(database)
+
+    count = 10
+    zipname = _testzip(count)
+    fileid = _filemodel.insert(database, zipname)
+
+    # use a small batchsize, so that multiple batches are inserted
+    orig_batchsize = _zipmodel.INSERT_BATCHSIZE
+    _zipmodel.INSERT_BATCHSIZE = 3
+    try:
+        _zipmodel.update(database)
+    finally:
+        _zipmodel.INSERT_BATCHSIZE = orig_batchsize
+
+    item = _zipmodel.get_by_fileid(database, fileid)
+    if item is None or item.error is not None:
+        raise ValueError('expected zipfile to be extracted without error')
+
+    # the members and the missing directory 'd' are extracted
+    if list(_zipmodel.extracted_files(database, only_pkey=True)) != [fileid]:
+        raise ValueError('expected zipfile to be listed as extracted')
+    files = {f.path: f for f in _filemodel.items(database) if f.path != zipname}
+    if len(files) != count + 1:
+        raise ValueError('unexpected number of extracted files')
+
+    for i in range(count):
+        f = files.get('d/f{:d}'.format(i))
+        if f is None or f.data.read() != _contents(i):
+            raise ValueError('unexpected contents of extracted file {:d}'.format(i))
+
+    # cleanup generated files
+    _helpers.clean_generated()
+
+
+def test_extract_corrupt_member():
+    ''' test that no partial extraction remains when a member is corrupt '''
+
+    # check if we are running from the correct path
+    _helpers.correct_path()
+
+    database = _helpers.generate_testdb()
+    _zipmodel.register_with_db(database)
+
+    zipname = _testzip(10, corrupt=7)
+    fileid = _filemodel.insert(database, zipname)
+    _zipmodel.update(database)
+
+    item = _zipmodel.get_by_fileid(database, fileid)
+    if item is None or item.error is None or item.contents is not None:
+        raise ValueError('expected zipfile extraction to fail with an error')
+
+    # only the zipfile itself and its data should be in the database
+    if _filemodel.file_count(database) != 1:
+        raise ValueError('expected no extracted files after failed extraction')
+    if _data_count(database) != (1, 1):
+        raise ValueError('expected no extracted data after failed extraction')
+
+    # the same should hold when extracting a local file directly, in which
+    # case only the metadata of the data of the zipfile itself is stored
+    database = _helpers.generate_testdb()
+    _zipmodel.register_with_db(database)
+
+    fileid, zipid = _zipmodel.insert_local_file(database, zipname)
+    if _zipmodel.get(database, zipid).error is None:
+        raise ValueError('expected zipfile extraction to fail with an error')
+    if _filemodel.file_count(database) != 1 or _data_count(database) != (1, 0):
+        raise ValueError('expected no extracted files after failed extraction')
+
+    # cleanup generated files
+    _helpers.clean_generated()